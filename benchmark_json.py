@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+JSON编解码性能对比
+生成包含5万条记录的测试文件，比较以下方式的写入(dump)和读取(load)速度及文件大小：
+标准库indent=2（旧的落盘格式）、标准库紧凑格式、orjson（已安装时）
+
+用法: python benchmark_json.py [--records 50000] [--repeat 3]
+"""
+
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+from benchmark_server import make_records
+
+try:
+    import orjson  # type: ignore
+except ImportError:
+    orjson = None
+
+
+def stdlib_indent_dump(data):
+    return json.dumps(data, ensure_ascii=False, indent=2).encode('utf-8')
+
+
+def stdlib_compact_dump(data):
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def stdlib_load(raw):
+    return json.loads(raw)
+
+
+def codecs():
+    """(名称, dump函数, load函数)"""
+    result = [
+        ('stdlib indent=2', stdlib_indent_dump, stdlib_load),
+        ('stdlib compact', stdlib_compact_dump, stdlib_load),
+    ]
+    if orjson is not None:
+        result.append(('orjson', orjson.dumps, orjson.loads))
+    return result
+
+
+def best_of(repeat, func, *args):
+    """重复执行取最短时间，返回(秒, 最后一次的返回值)"""
+    best = None
+    value = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        value = func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, value
+
+
+def main():
+    parser = argparse.ArgumentParser(description='比较JSON编解码的读写速度')
+    parser.add_argument('--records', type=int, default=50000, help='测试记录数')
+    parser.add_argument('--repeat', type=int, default=3, help='每项重复次数，取最快的一次')
+    args = parser.parse_args()
+
+    random.seed(0)
+    records = make_records(args.records)
+    directory = tempfile.mkdtemp(prefix='battery-json-')
+
+    print(f'记录数: {args.records}  orjson: {"已安装" if orjson is not None else "未安装"}')
+    print(f'{"编解码":<18}{"文件大小":>12}{"写入":>12}{"读取":>12}{"写入MB/s":>12}{"读取MB/s":>12}')
+    try:
+        for name, dump, load in codecs():
+            path = os.path.join(directory, name.replace(' ', '_') + '.json')
+
+            def write():
+                with open(path, 'wb') as f:
+                    f.write(dump(records))
+
+            def read():
+                with open(path, 'rb') as f:
+                    return load(f.read())
+
+            dump_time, _ = best_of(args.repeat, write)
+            load_time, loaded = best_of(args.repeat, read)
+            assert loaded == records
+            size = os.path.getsize(path)
+            mb = size / 1024 / 1024
+            print(f'{name:<18}{mb:>10.1f}MB{dump_time * 1000:>10.0f}ms{load_time * 1000:>10.0f}ms'
+                  f'{mb / dump_time:>12.0f}{mb / load_time:>12.0f}')
+            os.remove(path)
+    finally:
+        os.rmdir(directory)
+
+
+if __name__ == '__main__':
+    main()
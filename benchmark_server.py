@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""
+服务器引擎性能对比
+在临时目录中生成测试数据，分别以threaded和asyncio引擎启动python_server.py，
+并发请求几个常用接口，比较每秒请求数
+
+用法: python benchmark_server.py [--records 5000] [--requests 2000] [--concurrency 32]
+"""
+
+import argparse
+import http.client
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import quote
+
+# 参与测试的接口
+ENDPOINTS = [
+    '/api/batteries?page=1&pageSize=20',
+    '/api/batteries?status=' + quote('待维修') + '&page=1',
+    '/api/statistics',
+    '/api/settings',
+    '/index.html',
+]
+
+SERVER_ENGINES = ('threaded', 'asyncio')
+
+
+def make_records(count):
+    """生成测试记录"""
+    models = ['K174', 'K175', 'K176']
+    statuses = ['待维修', '维修中', '已完成']
+    records = []
+    for i in range(count):
+        records.append({
+            'id': str(1700000000000 + i),
+            'batteryBtCode': f'BT{i:08d}',
+            'bmsNumber': f'BMS{i:06d}',
+            'batteryModel': random.choice(models),
+            'cycleCount': str(random.randint(0, 2000)),
+            'returnReason': '压差大',
+            'returnDate': f'2024-{random.randint(1, 12):02d}-{random.randint(1, 28):02d}',
+            'returnArea': '华东',
+            'repairStatus': random.choice(statuses),
+            'repairCost': str(random.randint(0, 500)),
+            'causeAnalysis': '电芯老化导致压差大',
+        })
+    return records
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def prepare(root, records):
+    """复制服务器和静态文件到临时目录并写入测试数据"""
+    source = os.path.dirname(os.path.abspath(__file__))
+    for name in os.listdir(source):
+        if name.endswith(('.py', '.html', '.js', '.css')):
+            shutil.copy(os.path.join(source, name), root)
+    os.makedirs(os.path.join(root, 'data'), exist_ok=True)
+    with open(os.path.join(root, 'data', 'batteries.json'), 'w', encoding='utf-8') as f:
+        json.dump(records, f, ensure_ascii=False)
+
+
+def wait_ready(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            conn.request('GET', '/api/settings')
+            conn.getresponse().read()
+            conn.close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('服务器启动超时')
+
+
+def run_load(port, path, total, concurrency):
+    """并发请求path共total次，返回(每秒请求数, 失败次数)"""
+    remaining = [total]
+    errors = [0]
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            try:
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+                conn.request('GET', path, headers={'Accept-Encoding': 'gzip'})
+                response = conn.getresponse()
+                response.read()
+                conn.close()
+                if response.status != 200:
+                    raise OSError(response.status)
+            except OSError:
+                with lock:
+                    errors[0] += 1
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return total / (time.perf_counter() - start), errors[0]
+
+
+def benchmark(engine, root, args):
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(root, 'python_server.py'), '--host', '127.0.0.1', '--port', str(port),
+         '--engine', engine, '--workers', str(args.workers), '--no-browser'],
+        cwd=root, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_ready(port)
+        results = {}
+        for path in ENDPOINTS:
+            run_load(port, path, min(100, args.requests), args.concurrency)
+            results[path] = run_load(port, path, args.requests, args.concurrency)
+        return results
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='比较threaded和asyncio服务器引擎的每秒请求数')
+    parser.add_argument('--records', type=int, default=5000, help='测试数据记录数')
+    parser.add_argument('--requests', type=int, default=2000, help='每个接口的请求数')
+    parser.add_argument('--concurrency', type=int, default=32, help='并发客户端数')
+    parser.add_argument('--workers', type=int, default=8, help='服务器工作线程数')
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix='battery-bench-')
+    try:
+        prepare(root, make_records(args.records))
+        results = {}
+        for engine in SERVER_ENGINES:
+            results[engine] = benchmark(engine, root, args)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    print(f'记录数: {args.records}  每个接口请求数: {args.requests}  并发: {args.concurrency}')
+    print(f'{"接口":<40}' + ''.join(f'{engine:>14}' for engine in SERVER_ENGINES))
+    for path in ENDPOINTS:
+        row = f'{path[:40]:<40}'
+        for engine in SERVER_ENGINES:
+            rps, errors = results[engine][path]
+            row += f'{rps:>10.0f} rps' + (f' ({errors}失败)' if errors else '')
+        print(row)
+
+
+if __name__ == '__main__':
+    main()
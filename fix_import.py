@@ -1,183 +1,224 @@
 # -*- coding: utf-8 -*-
 """
 修复数据导入问题的脚本
+CSV和Excel都按行流式读取，表头只映射一次，记录分批产出并分批写入，
+导入大文件时内存占用只与批大小有关。
+服务器运行时记录通过POST /api/batteries/batch逐批写入服务器；
+服务器未运行时才直接写入batteries.json
 """
 
-import json
-from typing import List, Dict, Any
-
-
-def parse_csv_line(line: str) -> List[str]:
+import csv
+import io
+import os
+import time
+import urllib.error
+import urllib.request
+from itertools import chain
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence
+
+# 与服务器使用相同的JSON编解码（安装了orjson时使用orjson）和快照读写
+from python_server import json_dumps, json_loads, read_snapshot, write_snapshot_chunks
+
+# 默认每批处理的记录数
+DEFAULT_BATCH_SIZE = 1000
+
+# 电池售后管理系统服务器地址
+DEFAULT_SERVER_URL = os.environ.get('BATTERY_SERVER_URL', 'http://127.0.0.1:3000')
+
+EXPECTED_HEADERS = [
+    '电池BT码', 'BMS编号', '电池型号', '循环次数', '返厂原因',
+    '返厂时间', '客退地区', '维修状态', '维修项目', '维修费用',
+    '维修时间', '快递公司', '运费金额', '责任归属', '维修工时费',
+    '原因分析', '改善措施', '维修措施'
+]
+
+# 表头与记录字段的对应关系
+FIELD_MAP = {
+    '电池BT码': 'batteryBtCode',
+    'BMS编号': 'bmsNumber',
+    '电池型号': 'batteryModel',
+    '循环次数': 'cycleCount',
+    '返厂原因': 'returnReason',
+    '返厂时间': 'returnDate',
+    '客退地区': 'returnArea',
+    '维修状态': 'repairStatus',
+    '维修项目': 'repairItem',
+    '维修费用': 'repairCost',
+    '维修时间': 'repairDate',
+    '快递公司': 'expressCompany',
+    '运费金额': 'shippingCost',
+    '责任归属': 'responsibility',
+    '维修工时费': 'laborCost',
+    '原因分析': 'causeAnalysis',
+    '改善措施': 'improvements',
+    '维修措施': 'repairMeasures'
+}
+
+
+class IdGenerator:
     """
-    更安全的CSV解析器
+    生成递增的记录ID
+    以毫秒时间戳为基础，同一毫秒内的记录依次加1。
+    大批量导入会让ID领先于当前时间，因此只保证同一个输出文件内不重复：
+    写入前需要用advance()跳过文件中已有的最大ID
     """
-    if not line:
-        return []
 
-    result = []
-    current = ''
-    inside_quotes = False
-
-    i = 0
-    while i < len(line):
-        char = line[i]
-        next_char = line[i + 1] if i < len(line) - 1 else ''
-
-        if char == '"' and not inside_quotes:
-            inside_quotes = True
-        elif char == '"' and inside_quotes:
-            if next_char == '"':
-                current += '"'
-                i += 1  # 跳过下一个引号
-            else:
-                inside_quotes = False
-        elif char == ',' and not inside_quotes:
-            result.append(current)
-            current = ''
-        else:
-            current += char
+    def __init__(self):
+        self._last_id = 0
 
-        i += 1
+    def advance(self, battery_id: Any) -> None:
+        """保证之后生成的ID大于battery_id"""
+        battery_id = str(battery_id or '')
+        if battery_id.isdigit():
+            self._last_id = max(self._last_id, int(battery_id))
 
-    result.append(current)
-    return result
+    def __call__(self) -> str:
+        self._last_id = max(int(time.time() * 1000), self._last_id + 1)
+        return str(self._last_id)
 
 
-def parse_csv(csv_text: str) -> List[Dict[str, Any]]:
+def parse_csv_line(line: str) -> List[str]:
     """
-    安全的CSV解析
+    解析单行CSV
     """
-    if not csv_text:
-        return []
-
-    # 将CSV文本分割为行
-    lines = csv_text.strip().split('\n')
-    if len(lines) <= 1:
-        print('CSV文件格式无效或为空')
+    if not line:
         return []
+    return next(csv.reader([line]), [''])
 
-    # 解析头部
-    headers = parse_csv_line(lines[0])
-
-    expected_headers = [
-        '电池BT码', 'BMS编号', '电池型号', '循环次数', '返厂原因',
-        '返厂时间', '客退地区', '维修状态', '维修项目', '维修费用',
-        '维修时间', '快递公司', '运费金额', '责任归属', '维修工时费',
-        '原因分析', '改善措施', '维修措施'
-    ]
 
-    # 构建字段映射
+def map_headers(headers: Sequence[Any]) -> Dict[str, int]:
+    """
+    构建期望表头到列索引的映射
+    """
     header_map = {}
     for index, header in enumerate(headers):
+        header = '' if header is None else str(header).strip()
         if not header:
             continue
 
         # 为每个期望的标题找到最匹配的实际标题
-        for expected in expected_headers:
+        for expected in EXPECTED_HEADERS:
             if expected in header or header in expected:
                 header_map[expected] = index
                 break
 
-    # 解析数据
-    records = []
-    for i in range(1, len(lines)):
-        if not lines[i].strip():  # 跳过空行
-            continue
+    return header_map
+
+
+def iter_records(rows: Iterable[Sequence[Any]], id_generator: Optional[IdGenerator] = None) -> Iterator[Dict[str, Any]]:
+    """
+    把行数据（第一行为表头）转换为记录，跳过空行
+    """
+    rows = iter(rows)
+    headers = next(rows, None)
+    if headers is None:
+        return
 
-        # 解析CSV行，处理引号等特殊情况
-        values = parse_csv_line(lines[i])
-        if not values or len(values) == 0:
+    # 表头只映射一次，之后每行按列索引直接取值
+    columns = [
+        (FIELD_MAP[expected], index)
+        for expected, index in map_headers(headers).items()
+    ]
+    next_id = id_generator or IdGenerator()
+
+    for values in rows:
+        if not values or all(value is None or str(value).strip() == '' for value in values):
             continue
 
-        def safe_get_value(header_name: str) -> str:
-            """安全地获取值，防止索引错误"""
-            if header_name not in header_map:
-                return ''
-            index = header_map[header_name]
-            if index >= len(values) or values[index] is None:
-                return ''
-            return str(values[index])
-
-        # 创建记录对象
-        import time
-        import random
-        record = {
-            'id': str(int(time.time() * 1000) + random.randint(0, 999)),
-            'batteryBtCode': safe_get_value('电池BT码'),
-            'bmsNumber': safe_get_value('BMS编号'),
-            'batteryModel': safe_get_value('电池型号'),
-            'cycleCount': safe_get_value('循环次数'),
-            'returnReason': safe_get_value('返厂原因'),
-            'returnDate': safe_get_value('返厂时间'),
-            'returnArea': safe_get_value('客退地区'),
-            'repairStatus': safe_get_value('维修状态'),
-            'repairItem': safe_get_value('维修项目'),
-            'repairCost': safe_get_value('维修费用'),
-            'repairDate': safe_get_value('维修时间'),
-            'expressCompany': safe_get_value('快递公司'),
-            'shippingCost': safe_get_value('运费金额'),
-            'responsibility': safe_get_value('责任归属'),
-            'laborCost': safe_get_value('维修工时费'),
-            'causeAnalysis': safe_get_value('原因分析'),
-            'improvements': safe_get_value('改善措施'),
-            'repairMeasures': safe_get_value('维修措施')
-        }
-
-        records.append(record)
+        record = {'id': next_id()}
+        for field in FIELD_MAP.values():
+            record[field] = ''
+        for field, index in columns:
+            if index < len(values) and values[index] is not None:
+                record[field] = str(values[index])
 
-    return records
+        yield record
 
-def parse_excel(data: bytes) -> List[Dict[str, Any]]:
+
+def iter_csv_rows(file_path: str) -> Iterator[List[str]]:
     """
-    安全的Excel解析
+    逐行读取CSV文件（兼容带BOM的UTF-8）
+    """
+    with open(file_path, 'r', encoding='utf-8-sig', newline='') as f:
+        yield from csv.reader(f)
+
+
+def iter_excel_rows(source: Any) -> Iterator[Sequence[Any]]:
+    """
+    以只读模式逐行读取Excel工作表
     注意：这个函数需要openpyxl库来处理Excel文件
     如果没有安装，请运行: pip install openpyxl
     """
     try:
-        try:
-            from openpyxl import load_workbook  # type: ignore
-        except ImportError:
-            print('Excel解析错误: 需要安装openpyxl库')
-            print('请运行: pip install openpyxl')
-            return []
+        from openpyxl import load_workbook  # type: ignore
+    except ImportError:
+        raise ImportError('需要安装openpyxl库，请运行: pip install openpyxl')
 
-        import io
+    workbook = load_workbook(source, read_only=True, data_only=True)
+    try:
+        yield from workbook.active.iter_rows(values_only=True)
+    finally:
+        workbook.close()
 
-        # 从字节数据创建工作簿
-        workbook = load_workbook(io.BytesIO(data))
-        sheet = workbook.active
 
-        # 获取所有行数据
-        raw_data = []
-        for row in sheet.iter_rows(values_only=True):
-            raw_data.append(list(row))
+def iter_file_rows(file_path: str) -> Iterator[Sequence[Any]]:
+    """
+    根据扩展名选择CSV或Excel读取方式
+    """
+    if file_path.lower().endswith('.csv'):
+        return iter_csv_rows(file_path)
+    if file_path.lower().endswith(('.xlsx', '.xls')):
+        return iter_excel_rows(file_path)
+    raise ValueError('不支持的文件格式，请使用CSV或Excel文件')
 
-        if len(raw_data) <= 1:
-            raise ValueError('Excel文件格式无效或为空')
 
-        # 转换为CSV文本格式
-        csv_lines = []
-        for row in raw_data:
-            csv_row = []
-            for cell in row:
-                # 处理单元格内容，包装引号并处理特殊字符
-                cell_str = '' if cell is None else str(cell)
-                if ',' in cell_str or '"' in cell_str or '\n' in cell_str:
-                    cell_str = '"' + cell_str.replace('"', '""') + '"'
-                csv_row.append(cell_str)
-            csv_lines.append(','.join(csv_row))
-
-        csv_text = '\n'.join(csv_lines)
-
-        # 使用CSV解析器处理
-        return parse_csv(csv_text)
+def iter_record_batches(file_path: str, batch_size: int = DEFAULT_BATCH_SIZE,
+                        id_generator: Optional[IdGenerator] = None) -> Iterator[List[Dict[str, Any]]]:
+    """
+    流式读取文件，按批产出记录
+    """
+    batch = []
+    for record in iter_records(iter_file_rows(file_path), id_generator):
+        batch.append(record)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def parse_csv(csv_text: str) -> List[Dict[str, Any]]:
+    """
+    安全的CSV解析
+    """
+    if not csv_text:
+        return []
+
+    records = list(iter_records(csv.reader(io.StringIO(csv_text.strip()))))
+    if not records:
+        print('CSV文件格式无效或为空')
+    return records
+
+
+def parse_excel(data: bytes) -> List[Dict[str, Any]]:
+    """
+    安全的Excel解析
+    注意：这个函数需要openpyxl库来处理Excel文件
+    如果没有安装，请运行: pip install openpyxl
+    """
+    try:
+        records = list(iter_records(iter_excel_rows(io.BytesIO(data))))
+        if not records:
+            raise ValueError('Excel文件格式无效或为空')
+        return records
     except Exception as error:
         print(f'Excel解析错误: {error}')
         return []
 
+
 def import_data_from_file(file_path: str) -> List[Dict[str, Any]]:
     """
-    从文件导入数据
+    从文件导入数据（一次性返回全部记录，大文件请使用iter_record_batches）
     """
     try:
         if not file_path:
@@ -185,23 +226,10 @@ def import_data_from_file(file_path: str) -> List[Dict[str, Any]]:
             return []
 
         data = []
+        for batch in iter_record_batches(file_path):
+            data.extend(batch)
 
-        # 判断文件类型
-        if file_path.lower().endswith('.csv'):
-            # 解析CSV
-            with open(file_path, 'r', encoding='utf-8') as f:
-                csv_text = f.read()
-                data = parse_csv(csv_text)
-        elif file_path.lower().endswith(('.xlsx', '.xls')):
-            # 解析Excel
-            with open(file_path, 'rb') as f:
-                excel_data = f.read()
-                data = parse_excel(excel_data)
-        else:
-            print('不支持的文件格式，请使用CSV或Excel文件')
-            return []
-
-        if not data or len(data) == 0:
+        if not data:
             print('没有找到可导入的数据')
             return []
 
@@ -213,39 +241,151 @@ def import_data_from_file(file_path: str) -> List[Dict[str, Any]]:
         return []
 
 
-def save_data_to_json(data: List[Dict[str, Any]], output_file: str = 'data/batteries.json') -> bool:
+def server_is_running(server_url: str = DEFAULT_SERVER_URL) -> bool:
     """
-    将数据保存到JSON文件
+    服务器是否在运行
     """
     try:
-        import os
-
-        # 确保目录存在
-        os.makedirs(os.path.dirname(output_file), exist_ok=True)
+        with urllib.request.urlopen(server_url.rstrip('/') + '/api/settings', timeout=2):
+            return True
+    except urllib.error.HTTPError:
+        return True
+    except OSError:
+        return False
 
-        # 如果文件已存在，读取现有数据
-        existing_data = []
-        if os.path.exists(output_file):
-            try:
-                with open(output_file, 'r', encoding='utf-8') as f:
-                    existing_data = json.load(f)
-            except:
-                existing_data = []
 
-        # 合并数据
-        combined_data = existing_data + data
+def post_batches_to_server(batches: Iterable[List[Dict[str, Any]]],
+                           server_url: str = DEFAULT_SERVER_URL) -> int:
+    """
+    通过POST /api/batteries/batch逐批新增记录，返回新增的记录数
+    记录ID由服务器分配，每批在服务器端原子生效
+    """
+    url = server_url.rstrip('/') + '/api/batteries/batch'
+    count = 0
+    for batch in batches:
+        if not batch:
+            continue
+        operations = [
+            {'op': 'create', 'data': {key: value for key, value in record.items() if key != 'id'}}
+            for record in batch
+        ]
+        request = urllib.request.Request(url, data=json_dumps(operations), method='POST',
+                                         headers={'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(request) as response:
+                count += json_loads(response.read())['count']
+        except urllib.error.HTTPError as error:
+            raise RuntimeError(f'服务器拒绝了导入请求({error.code}): {error.read().decode("utf-8", "replace")}')
+    return count
 
-        # 保存到文件
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(combined_data, f, ensure_ascii=False, indent=2)
 
-        print(f'成功保存了{len(combined_data)}条记录到 {output_file}')
+def check_offline_import(output_file: str, server_url: str = DEFAULT_SERVER_URL) -> None:
+    """
+    直接写入数据文件前的检查：服务器运行时内存中的数据会在下次压缩时覆盖该文件，
+    日志中还有未合并的修改时写入的内容会与之冲突，使用SQLite存储时该文件不再被读取
+    """
+    directory = os.path.dirname(output_file)
+    if server_is_running(server_url):
+        raise RuntimeError(f'服务器正在运行({server_url})，请通过服务器导入')
+    journal_file = os.path.join(directory, 'batteries.journal')
+    if os.path.exists(journal_file) and os.path.getsize(journal_file) > 0:
+        raise RuntimeError(f'{journal_file}中还有未合并的修改，请先启动并正常关闭一次服务器')
+    if os.path.exists(os.path.join(directory, 'batteries.db')):
+        raise RuntimeError('当前使用SQLite存储，请启动服务器后通过服务器导入')
+
+
+def save_batches_to_json(batches: Iterable[List[Dict[str, Any]]], output_file: str = 'data/batteries.json',
+                         id_generator: Optional[IdGenerator] = None,
+                         server_url: str = DEFAULT_SERVER_URL) -> int:
+    """
+    服务器未运行时，把分批产出的记录追加到JSON文件，返回新增的记录数
+    通过服务器的write_snapshot_chunks逐批写入：先写临时文件并fsync，保留历史版本后再替换原文件。
+    id_generator在读取现有数据后跳过其中的最大ID；新记录的ID与已有ID重复时重新分配
+    """
+    check_offline_import(output_file, server_url)
+
+    # 没有新记录时不改写文件
+    batches = (batch for batch in batches if batch)
+    first_batch = next(batches, None)
+    if first_batch is None:
+        return 0
+
+    directory = os.path.dirname(output_file)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    # 现有数据损坏时直接报错，不会用空数据覆盖
+    existing_data = read_snapshot(output_file, default=[], allow_fallback=False)
+
+    next_id = id_generator or IdGenerator()
+    seen_ids = set()
+    for record in existing_data:
+        seen_ids.add(str(record.get('id')))
+        next_id.advance(record.get('id'))
+
+    count = 0
+
+    def unique_ids(records):
+        for record in records:
+            if not record.get('id') or str(record['id']) in seen_ids:
+                record = {**record, 'id': next_id()}
+            seen_ids.add(str(record['id']))
+            yield record
+
+    def chunks():
+        nonlocal count, existing_data
+        first = True
+        yield b'['
+        for record in existing_data:
+            yield (b'' if first else b',') + json_dumps(record)
+            first = False
+        existing_data = None
+
+        for batch in chain([first_batch], batches):
+            for record in unique_ids(batch):
+                yield (b'' if first else b',') + json_dumps(record)
+                first = False
+            count += len(batch)
+        yield b']'
+
+    write_snapshot_chunks(output_file, chunks())
+    return count
+
+
+def save_data_to_json(data: List[Dict[str, Any]], output_file: str = 'data/batteries.json',
+                      server_url: str = DEFAULT_SERVER_URL) -> bool:
+    """
+    保存数据：服务器运行时通过批量接口写入，否则写入JSON文件
+    """
+    try:
+        if server_is_running(server_url):
+            count = post_batches_to_server([data], server_url)
+            print(f'成功通过服务器保存了{count}条新记录')
+        else:
+            count = save_batches_to_json([data], output_file, server_url=server_url)
+            print(f'成功保存了{count}条新记录到 {output_file}')
         return True
 
     except Exception as error:
         print(f'保存数据时出错: {error}')
         return False
 
+
+def import_file_to_json(file_path: str, output_file: str = 'data/batteries.json',
+                        batch_size: int = DEFAULT_BATCH_SIZE, server_url: str = DEFAULT_SERVER_URL) -> int:
+    """
+    流式导入：边读取边写入，返回导入的记录数
+    服务器运行时逐批发送到服务器，否则写入output_file
+    """
+    if server_is_running(server_url):
+        return post_batches_to_server(iter_record_batches(file_path, batch_size), server_url)
+
+    # 读取文件与写入共用同一个ID生成器，写入前会先跳过已有记录的最大ID
+    id_generator = IdGenerator()
+    return save_batches_to_json(iter_record_batches(file_path, batch_size, id_generator), output_file,
+                                id_generator, server_url)
+
+
 def main():
     """
     主函数 - 示例用法
@@ -253,25 +393,29 @@ def main():
     import sys
 
     if len(sys.argv) < 2:
-        print("用法: python fix_import.py <文件路径>")
+        print("用法: python fix_import.py <文件路径> [输出文件]")
         print("示例: python fix_import.py data/import.csv")
+        print(f"服务器运行时通过服务器导入（地址由环境变量BATTERY_SERVER_URL指定，默认{DEFAULT_SERVER_URL}）")
         return
 
     file_path = sys.argv[1]
+    output_file = sys.argv[2] if len(sys.argv) > 2 else 'data/batteries.json'
 
-    # 导入数据
-    data = import_data_from_file(file_path)
+    try:
+        start = time.time()
+        target = DEFAULT_SERVER_URL if server_is_running() else output_file
+        count = import_file_to_json(file_path, output_file)
+    except Exception as error:
+        print(f'导入处理错误: {error}')
+        print("数据导入失败！")
+        return
 
-    if data:
-        # 保存数据
-        success = save_data_to_json(data)
-        if success:
-            print("数据导入完成！")
-        else:
-            print("数据保存失败！")
+    if count:
+        print(f'成功导入了{count}条记录到 {target}，用时{time.time() - start:.1f}秒')
+        print("数据导入完成！")
     else:
         print("没有数据可导入")
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
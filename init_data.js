@@ -1,16 +1,18 @@
 // 初始化数据脚本 - 添加电池数据到localStorage
 
 /**
- * 从JSON文件加载全部电池数据
+ * 从服务器加载全部电池数据
+ * 使用/api/batteries而不是静态的data/batteries.json：服务器的修改先写入日志，
+ * 快照文件会滞后，使用SQLite存储时也不再更新
  */
 async function loadAllBatteriesFromJSON() {
     try {
-        const response = await fetch('data/batteries.json');
+        const response = await fetch('/api/batteries');
         if (!response.ok) {
             throw new Error('无法加载电池数据文件');
         }
         const batteries = await response.json();
-        console.log(`已从JSON文件加载 ${batteries.length} 条记录`);
+        console.log(`已从服务器加载 ${batteries.length} 条记录`);
         return batteries;
     } catch (error) {
         console.error('加载电池数据文件出错:', error);
@@ -28,7 +30,7 @@ async function addBatteryData() {
     }
 
     try {
-        // 先尝试从JSON文件加载数据
+        // 先尝试从服务器加载数据
         const batteries = await loadAllBatteriesFromJSON();
         
         if (batteries && batteries.length > 0) {
@@ -5,13 +5,2212 @@
 不依赖Node.js的独立服务器
 """
 
+import io
 import os
+import re
+import sys
+import csv
 import json
+import bisect
+import math
+import time
+import gzip
+import zlib
+import base64
+import binascii
+import shutil
+import hashlib
+import tempfile
+import datetime
+import queue
+import atexit
+import socket
+import selectors
+import sqlite3
 import threading
 import webbrowser
+from collections import Counter, OrderedDict
 from http.server import HTTPServer, SimpleHTTPRequestHandler
-from urllib.parse import urlparse, parse_qs
+from urllib.parse import urlparse, parse_qs, quote
 import socketserver
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import brotli  # type: ignore
+except ImportError:
+    brotli = None
+
+try:
+    import msgpack  # type: ignore
+except ImportError:
+    msgpack = None
+
+try:
+    import orjson  # type: ignore
+except ImportError:
+    orjson = None
+
+
+# JSON编解码：安装了orjson时使用orjson，否则使用标准库；默认输出紧凑格式
+JSON_BACKEND = 'orjson' if orjson is not None else 'json'
+_compact_encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+
+def json_dumps(data):
+    """编码为紧凑的UTF-8 JSON字节"""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+    return _compact_encoder.encode(data).encode('utf-8')
+
+
+def json_loads(data):
+    """解码JSON（bytes或str），兼容记事本保存时带的BOM"""
+    if isinstance(data, bytes) and data.startswith(b'\xef\xbb\xbf'):
+        data = data[3:]
+    elif isinstance(data, str) and data.startswith('\ufeff'):
+        data = data[1:]
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+# 进程启动标识，版本号每次启动从0开始，ETag中带上它避免重启后与旧ETag冲突
+ETAG_EPOCH = format(int(time.time() * 1000), 'x')
+
+# 保护数据文件的创建和settings.json的读写
+_data_files_lock = threading.Lock()
+_settings_lock = threading.RLock()
+
+
+# 列表查询参数
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 1000
+LIST_QUERY_PARAMS = ('page', 'pageSize', 'status', 'model', 'q', 'dateFrom', 'dateTo', 'sort')
+SEARCH_FIELDS = ('batteryBtCode', 'batteryModel', 'bmsNumber')
+_FIELD_NAME_RE = re.compile(r'[A-Za-z_][A-Za-z0-9_]*')
+
+
+def parse_battery_query(params, force=False):
+    """
+    把/api/batteries的查询参数解析为查询条件
+    没有任何列表查询参数时返回None，保持返回完整数组的旧接口；force为True时返回默认条件
+    """
+    if not force and not any(key in params for key in LIST_QUERY_PARAMS):
+        return None
+
+    def first(key):
+        values = params.get(key)
+        return values[0].strip() if values else ''
+
+    try:
+        page = int(first('page') or 1)
+        page_size = int(first('pageSize') or DEFAULT_PAGE_SIZE)
+    except ValueError:
+        raise ValueError('page和pageSize必须是整数')
+    if page < 1 or page_size < 1:
+        raise ValueError('page和pageSize必须大于0')
+
+    sort = first('sort')
+    if sort and not _FIELD_NAME_RE.fullmatch(sort.lstrip('-')):
+        raise ValueError(f'无效的排序字段: {sort}')
+
+    date_from = parse_date(first('dateFrom')) if first('dateFrom') else None
+    date_to = parse_date(first('dateTo')) if first('dateTo') else None
+    if (first('dateFrom') and date_from is None) or (first('dateTo') and date_to is None):
+        raise ValueError('dateFrom和dateTo必须是有效日期')
+
+    return {
+        'page': page,
+        'page_size': min(page_size, MAX_PAGE_SIZE),
+        'status': first('status'),
+        'model': first('model'),
+        'q': first('q').lower(),
+        'date_from': date_from,
+        'date_to': date_to,
+        'sort': sort,
+    }
+
+
+def record_matches(record, criteria):
+    """判断记录是否满足查询条件（与records.js中filterRecords的规则一致）"""
+    if criteria['status'] and record.get('repairStatus') != criteria['status']:
+        return False
+    if criteria['model'] and record.get('batteryModel') != criteria['model']:
+        return False
+    if criteria['q']:
+        q = criteria['q']
+        if not any(q in str(record.get(field) or '').lower() for field in SEARCH_FIELDS):
+            return False
+    # 与JS一致：没有返厂时间的记录不参与日期过滤，无法解析的日期不匹配
+    if (criteria['date_from'] or criteria['date_to']) and record.get('returnDate'):
+        return_date = parse_date(record.get('returnDate'))
+        if return_date is None:
+            return False
+        if criteria['date_from'] and return_date < criteria['date_from']:
+            return False
+        if criteria['date_to'] and return_date > criteria['date_to']:
+            return False
+    return True
+
+
+# 按数值排序的字段（与JS的parseFloat一致，无法解析时为0）
+NUMERIC_SORT_FIELDS = ('cycleCount', 'repairCost', 'shippingCost', 'laborCost')
+
+
+def normalize_day(value):
+    """
+    返厂时间规范化为YYYY-MM-DD，用于过滤和排序；
+    没有值时返回None，有值但无法解析时返回空字符串
+    """
+    if not value:
+        return None
+    day = parse_date(value)
+    return day.isoformat() if day else ''
+
+
+def sort_key(field):
+    """记录排序键：数值字段按数值，返厂时间按规范化后的日期，其余按字符串"""
+    if field in NUMERIC_SORT_FIELDS:
+        return lambda record: parse_number(record.get(field))
+    if field == 'returnDate':
+        return lambda record: normalize_day(record.get(field)) or ''
+    return lambda record: str(record.get(field) or '')
+
+
+_NUMBER_RE = re.compile(r'\s*[-+]?(\d+\.?\d*|\.\d+)')
+_DATE_RE = re.compile(r'(\d{4})[-/.年](\d{1,2})(?:[-/.月](\d{1,2}))?')
+INVALID_DATE_VALUES = ('', '请选择时间', 'yyyy/mm/日')
+
+
+def parse_number(value):
+    """与JS的parseFloat(value) || 0一致：取开头的数字，无法解析时为0"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = _NUMBER_RE.match(str(value or ''))
+    return float(match.group(0)) if match else 0.0
+
+
+def parse_date(value):
+    """解析记录中的日期字符串，无法解析时返回None"""
+    if value is None or str(value) in INVALID_DATE_VALUES:
+        return None
+    match = _DATE_RE.search(str(value))
+    if not match:
+        return None
+    try:
+        return datetime.date(int(match.group(1)), int(match.group(2)), int(match.group(3) or 1))
+    except ValueError:
+        return None
+
+
+def _bump(counter, key, delta):
+    """计数加减，减到0时删除该键"""
+    value = counter.get(key, 0) + delta
+    if value:
+        counter[key] = value
+    else:
+        counter.pop(key, None)
+
+
+def _bump_nested(mapping, outer, inner, delta):
+    counter = mapping.setdefault(outer, {})
+    _bump(counter, inner, delta)
+    if not counter:
+        del mapping[outer]
+
+
+def _round_values(values):
+    return {key: round(value, 2) if isinstance(value, float) else value for key, value in values.items()}
+
+
+class StatisticsAggregator:
+    """
+    统计汇总的增量维护
+    新增、修改、删除记录时按差值更新各项计数和费用合计，
+    各项默认值与statistics.js中对应的图表函数保持一致。
+    超时统计依赖当天日期，只保存未维修完成的记录，在生成快照时计算
+    """
+
+    def __init__(self, records=()):
+        self._lock = threading.Lock()
+        self.total = 0
+        self.total_cost = 0.0
+        self.model_costs = {}
+        # 没有日期的记录计入生成快照时的当月，键为None
+        self.monthly_costs = {}
+        self.reason_counts = {}
+        self.reason_models = {}
+        self.status_counts = {}
+        self.status_models = {}
+        self.area_counts = {}
+        self.area_models = {}
+        self.responsibility_counts = {}
+        self.open_records = {}
+        for record in records:
+            self._apply(record, 1)
+
+    def replace(self, old, new):
+        """用新记录替换旧记录，新增时old为None，删除时new为None"""
+        with self._lock:
+            if old is not None:
+                self._apply(old, -1)
+            if new is not None:
+                self._apply(new, 1)
+
+    def _apply(self, record, sign):
+        model = record.get('batteryModel') or '其他'
+        repair_cost = sign * parse_number(record.get('repairCost'))
+        shipping_cost = sign * parse_number(record.get('shippingCost'))
+        labor_cost = sign * parse_number(record.get('laborCost'))
+
+        self.total += sign
+        self.total_cost += repair_cost + shipping_cost + labor_cost
+        self._add_costs(self.model_costs, model, repair_cost, shipping_cost, labor_cost, sign)
+
+        # 按维修时间统计，没有则用返厂时间
+        date = parse_date(record.get('repairDate')) or parse_date(record.get('returnDate'))
+        month = date.strftime('%Y-%m') if date else None
+        self._add_costs(self.monthly_costs, month, repair_cost, shipping_cost, labor_cost, sign)
+
+        reason = record.get('returnReason') or '未知原因'
+        _bump(self.reason_counts, reason, sign)
+        _bump_nested(self.reason_models, reason, model, sign)
+
+        status = record.get('repairStatus') or '待维修'
+        _bump(self.status_counts, status, sign)
+        _bump_nested(self.status_models, model, status, sign)
+
+        area = record.get('customerArea') or record.get('returnArea') or '未知地区'
+        _bump(self.area_counts, area, sign)
+        _bump_nested(self.area_models, area, model, sign)
+
+        _bump(self.responsibility_counts, record.get('responsibility') or '未确定', sign)
+
+        if record.get('repairStatus') != '已维修':
+            if sign > 0:
+                received = parse_date(record.get('returnDate')) or parse_date(record.get('createdAt'))
+                self.open_records[record.get('id')] = received
+            else:
+                self.open_records.pop(record.get('id'), None)
+
+    @staticmethod
+    def _add_costs(mapping, key, repair_cost, shipping_cost, labor_cost, sign):
+        costs = mapping.setdefault(key, {'repair': 0.0, 'shipping': 0.0, 'labor': 0.0, 'count': 0})
+        costs['repair'] += repair_cost
+        costs['shipping'] += shipping_cost
+        costs['labor'] += labor_cost
+        costs['count'] += sign
+        if costs['count'] == 0:
+            del mapping[key]
+
+    def snapshot(self, today=None):
+        """生成统计结果"""
+        today = today or datetime.date.today()
+        with self._lock:
+            monthly_costs = {month: dict(costs) for month, costs in self.monthly_costs.items() if month}
+            undated = self.monthly_costs.get(None)
+            if undated:
+                current = monthly_costs.setdefault(
+                    today.strftime('%Y-%m'), {'repair': 0.0, 'shipping': 0.0, 'labor': 0.0, 'count': 0}
+                )
+                for key, value in undated.items():
+                    current[key] += value
+
+            # 与statistics.js一致：按自然日向上取整，没有日期的记录按30天计
+            overdue = []
+            for battery_id, received in self.open_records.items():
+                days = (today - received).days + 1 if received else 30
+                if days >= 7:
+                    overdue.append((days, battery_id))
+            overdue.sort(key=lambda item: (-item[0], str(item[1])))
+
+            return {
+                'total': self.total,
+                'costs': {
+                    'total': round(self.total_cost, 2),
+                    'byModel': {model: _round_values(costs) for model, costs in self.model_costs.items()},
+                    'byMonth': {month: _round_values(monthly_costs[month]) for month in sorted(monthly_costs)},
+                },
+                'reasons': {'counts': dict(self.reason_counts), 'byModel': _copy_nested(self.reason_models)},
+                'status': {'counts': dict(self.status_counts), 'byModel': _copy_nested(self.status_models)},
+                'areas': {'counts': dict(self.area_counts), 'byModel': _copy_nested(self.area_models)},
+                'responsibility': {'counts': dict(self.responsibility_counts)},
+                'overdue': {
+                    'overdue7': {'count': len(overdue), 'ids': [battery_id for _, battery_id in overdue]},
+                    'overdue15': {
+                        'count': sum(1 for days, _ in overdue if days >= 15),
+                        'ids': [battery_id for days, battery_id in overdue if days >= 15],
+                    },
+                },
+            }
+
+
+def _copy_nested(mapping):
+    return {key: dict(value) for key, value in mapping.items()}
+
+
+def compute_statistics(records, today=None):
+    """一次遍历计算全部统计数据"""
+    return StatisticsAggregator(records).snapshot(today)
+
+
+# 支持前缀搜索的字段
+PREFIX_FIELDS = ('batteryBtCode', 'bmsNumber')
+DEFAULT_SEARCH_LIMIT = 10
+MAX_SEARCH_LIMIT = 100
+
+
+class PrefixIndex:
+    """
+    电池BT码和BMS编号的前缀索引
+    每个字段维护按小写值排序的不重复值列表和值到记录ID列表的映射，
+    用二分查找定位前缀，查询耗时与数据量的对数和返回条数有关。
+    同一个值可以对应多条记录（同一电池多次返厂），记录ID可以缺失或不是字符串
+    """
+
+    def __init__(self, records=(), fields=PREFIX_FIELDS):
+        self.fields = fields
+        self._lock = threading.Lock()
+        self._values = {field: [] for field in fields}
+        self._ids = {field: {} for field in fields}
+        for field in fields:
+            ids = self._ids[field]
+            for record in records:
+                value = self._value(record, field)
+                if value is not None:
+                    ids.setdefault(value, []).append(record.get('id'))
+            self._values[field] = sorted(ids)
+
+    @staticmethod
+    def _value(record, field):
+        value = record.get(field)
+        if value is None or str(value).strip() == '':
+            return None
+        return str(value).strip().lower()
+
+    def replace(self, old, new):
+        """用新记录替换旧记录，新增时old为None，删除时new为None"""
+        with self._lock:
+            for field in self.fields:
+                old_value = self._value(old, field) if old is not None else None
+                new_value = self._value(new, field) if new is not None else None
+                old_id = old.get('id') if old is not None else None
+                new_id = new.get('id') if new is not None else None
+                if old_value == new_value and old_id == new_id:
+                    continue
+                values = self._values[field]
+                ids = self._ids[field]
+                if old_value is not None and old_value in ids:
+                    old_ids = ids[old_value]
+                    if old_id in old_ids:
+                        old_ids.remove(old_id)
+                    if not old_ids:
+                        del ids[old_value]
+                        del values[bisect.bisect_left(values, old_value)]
+                if new_value is not None:
+                    if new_value not in ids:
+                        ids[new_value] = []
+                        bisect.insort(values, new_value)
+                    ids[new_value].append(new_id)
+
+    def search(self, prefix, limit=DEFAULT_SEARCH_LIMIT, fields=None):
+        """返回值以prefix开头的记录ID（去重），按字段顺序和值排序"""
+        prefix = prefix.strip().lower()
+        ids = []
+        seen = set()
+        with self._lock:
+            for field in fields or self.fields:
+                values = self._values[field]
+                i = bisect.bisect_left(values, prefix)
+                while i < len(values) and len(ids) < limit and values[i].startswith(prefix):
+                    for battery_id in self._ids[field][values[i]]:
+                        if len(ids) >= limit:
+                            break
+                        if battery_id not in seen:
+                            seen.add(battery_id)
+                            ids.append(battery_id)
+                    i += 1
+        return ids
+
+    def contains(self, value, fields=None):
+        """是否存在值完全相同的记录，用于判断电池是否曾经返厂"""
+        value = value.strip().lower()
+        with self._lock:
+            for field in fields or self.fields:
+                if value in self._ids[field]:
+                    return True
+        return False
+
+
+# 等值索引的字段，键为查询条件中的名称
+VALUE_INDEX_FIELDS = {'status': 'repairStatus', 'model': 'batteryModel'}
+
+
+class ValueIndex:
+    """
+    维修状态和电池型号的等值索引
+    每个字段维护值到记录ID集合的映射，按状态或型号过滤时只需检查候选记录
+    """
+
+    def __init__(self, records=(), fields=tuple(VALUE_INDEX_FIELDS.values())):
+        self.fields = fields
+        self._lock = threading.Lock()
+        self._ids = {field: {} for field in fields}
+        for record in records:
+            self._add(record)
+
+    def _add(self, record):
+        for field in self.fields:
+            self._ids[field].setdefault(record.get(field), set()).add(record.get('id'))
+
+    def _remove(self, record):
+        for field in self.fields:
+            ids = self._ids[field].get(record.get(field))
+            if ids is not None:
+                ids.discard(record.get('id'))
+                if not ids:
+                    del self._ids[field][record.get(field)]
+
+    def replace(self, old, new):
+        """用新记录替换旧记录，新增时old为None，删除时new为None"""
+        with self._lock:
+            if old is not None:
+                self._remove(old)
+            if new is not None:
+                self._add(new)
+
+    def lookup(self, field, value):
+        """返回字段值等于value的记录ID集合"""
+        with self._lock:
+            return set(self._ids[field].get(value, ()))
+
+
+# 全文检索的自由文本字段
+FULLTEXT_FIELDS = ('causeAnalysis', 'improvements', 'repairMeasures')
+DEFAULT_FULLTEXT_LIMIT = 20
+# 中文与字母数字分开切分
+_WORD_RE = re.compile(r'[\u3400-\u9fff]+|[^\W\u3400-\u9fff]+')
+
+
+def text_tokens(text):
+    """
+    把文本切分为字符二元组（适合没有分词器的中文），
+    单个字符的片段保留为单字
+    """
+    tokens = []
+    for segment in _WORD_RE.findall(str(text).lower()):
+        if len(segment) == 1:
+            tokens.append(segment)
+        else:
+            tokens.extend(segment[i:i + 2] for i in range(len(segment) - 1))
+    return tokens
+
+
+class FullTextIndex:
+    """
+    原因分析、改善措施、维修措施的倒排索引
+    词项为字符二元组，查询时要求包含全部词项，按TF-IDF排序；
+    单字词项匹配所有包含该字的词项
+    """
+
+    def __init__(self, records=(), fields=FULLTEXT_FIELDS):
+        self.fields = fields
+        self._lock = threading.Lock()
+        self._postings = {}
+        self._docs = {}
+        # 字符到包含它的词项集合，用于单字查询
+        self._char_tokens = {}
+        for record in records:
+            self._add(record)
+
+    def _document_tokens(self, record):
+        text = ' '.join(str(record.get(field) or '') for field in self.fields)
+        return Counter(text_tokens(text))
+
+    def _add(self, record):
+        counts = self._document_tokens(record)
+        if not counts:
+            return
+        battery_id = record.get('id')
+        self._docs[battery_id] = counts
+        for token, count in counts.items():
+            if token not in self._postings:
+                self._postings[token] = {}
+                for char in set(token):
+                    self._char_tokens.setdefault(char, set()).add(token)
+            self._postings[token][battery_id] = count
+
+    def _remove(self, battery_id):
+        counts = self._docs.pop(battery_id, None)
+        if not counts:
+            return
+        for token in counts:
+            postings = self._postings[token]
+            postings.pop(battery_id, None)
+            if not postings:
+                del self._postings[token]
+                for char in set(token):
+                    tokens = self._char_tokens[char]
+                    tokens.discard(token)
+                    if not tokens:
+                        del self._char_tokens[char]
+
+    def _token_postings(self, token):
+        """词项的倒排表{记录ID: 出现次数}；单字词项合并所有包含该字的词项"""
+        if len(token) > 1:
+            return self._postings.get(token)
+        merged = {}
+        for related in self._char_tokens.get(token, ()):
+            for battery_id, count in self._postings[related].items():
+                merged[battery_id] = merged.get(battery_id, 0) + count
+        return merged
+
+    def replace(self, old, new):
+        """用新记录替换旧记录，新增时old为None，删除时new为None"""
+        with self._lock:
+            if old is not None:
+                self._remove(old.get('id'))
+            if new is not None:
+                self._add(new)
+
+    def search(self, query, limit=DEFAULT_FULLTEXT_LIMIT):
+        """返回(按相关度排序的记录ID, 匹配总数)"""
+        tokens = set(text_tokens(query))
+        if not tokens:
+            return [], 0
+
+        with self._lock:
+            postings = []
+            for token in tokens:
+                posting = self._token_postings(token)
+                if not posting:
+                    return [], 0
+                postings.append(posting)
+
+            # 从最短的倒排表开始求交集
+            postings.sort(key=len)
+            candidates = set(postings[0])
+            for posting in postings[1:]:
+                candidates.intersection_update(posting)
+                if not candidates:
+                    return [], 0
+
+            total_docs = len(self._docs)
+            weights = [math.log(1 + total_docs / len(posting)) for posting in postings]
+            scored = []
+            for battery_id in candidates:
+                length = sum(self._docs[battery_id].values())
+                score = sum(weight * posting[battery_id] for weight, posting in zip(weights, postings))
+                scored.append((score / math.sqrt(length), battery_id))
+
+        scored.sort(key=lambda item: (-item[0], str(item[1])))
+        return [battery_id for _, battery_id in scored[:limit]], len(scored)
+
+
+# 批量写入单次最多的操作数
+MAX_BATCH_SIZE = 10000
+BATCH_OPERATIONS = ('create', 'update', 'delete')
+
+
+def parse_batch_operations(operations):
+    """
+    校验批量操作列表，返回[(op, id, data)]
+    格式: {"op": "create", "data": {...}} / {"op": "update", "id": "...", "data": {...}} / {"op": "delete", "id": "..."}
+    """
+    if not isinstance(operations, list):
+        raise ValueError('批量操作必须是数组')
+    if len(operations) > MAX_BATCH_SIZE:
+        raise ValueError(f'单次最多{MAX_BATCH_SIZE}个操作')
+
+    parsed = []
+    for i, operation in enumerate(operations):
+        op = operation.get('op') if isinstance(operation, dict) else None
+        if op not in BATCH_OPERATIONS:
+            raise ValueError(f'第{i + 1}个操作: op必须是create、update或delete')
+        battery_id = operation.get('id')
+        if op != 'create' and not isinstance(battery_id, str):
+            raise ValueError(f'第{i + 1}个操作: 缺少记录ID')
+        data = operation.get('data', {})
+        if op != 'delete' and not isinstance(data, dict):
+            raise ValueError(f'第{i + 1}个操作: data必须是对象')
+        parsed.append((op, battery_id, data))
+    return parsed
+
+
+def check_batch_targets(operations, exists):
+    """按顺序检查update/delete的目标记录是否存在（考虑同一批中之前的删除）"""
+    deleted = set()
+    for i, (op, battery_id, _) in enumerate(operations):
+        if op != 'create' and (battery_id in deleted or not exists(battery_id)):
+            raise KeyError(f'第{i + 1}个操作: 未找到记录 {battery_id}')
+        if op == 'delete':
+            deleted.add(battery_id)
+
+
+def change_operation(old, new):
+    """根据修改前后的记录判断操作类型"""
+    if old is None:
+        return 'create'
+    if new is None:
+        return 'delete'
+    return 'update'
+
+
+# 变更日志最多保留的记录数，超出后更早的游标需要全量刷新
+MAX_CHANGE_LOG_SIZE = 100000
+
+
+class ChangeLog:
+    """
+    记录变更日志，用于增量同步
+    每次修改分配一个单调递增的修订号（以毫秒时间戳为基础，重启后仍然递增），
+    每条记录只保留最近一次修改。日志只覆盖本次启动以来的修改，
+    早于base_revision的游标无法增量同步，需要客户端全量刷新
+    """
+
+    def __init__(self, max_size=MAX_CHANGE_LOG_SIZE):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._changes = OrderedDict()
+        self._listeners = []
+        self.revision = int(time.time() * 1000)
+        self.base_revision = self.revision
+
+    def subscribe(self, listener):
+        """注册修改通知，listener(battery_id, revision, operation)在修改线程中调用，应尽快返回"""
+        self._listeners.append(listener)
+
+    def record(self, battery_id, operation):
+        """记录一次修改（create/update/delete），返回新的修订号"""
+        with self._lock:
+            self.revision = max(int(time.time() * 1000), self.revision + 1)
+            revision = self.revision
+            self._changes.pop(battery_id, None)
+            self._changes[battery_id] = (revision, operation == 'delete')
+            while len(self._changes) > self.max_size:
+                _, (oldest, _) = self._changes.popitem(last=False)
+                self.base_revision = oldest
+
+        for listener in self._listeners:
+            listener(battery_id, revision, operation)
+        return revision
+
+    def since(self, revision):
+        """
+        返回(是否需要全量刷新, 当前修订号, 修改过的记录ID, 删除的记录ID)
+        """
+        with self._lock:
+            if revision < self.base_revision:
+                return True, self.revision, [], []
+            upserts = []
+            deleted = []
+            for battery_id, (change_revision, is_deleted) in reversed(self._changes.items()):
+                if change_revision <= revision:
+                    break
+                (deleted if is_deleted else upserts).append(battery_id)
+            upserts.reverse()
+            deleted.reverse()
+            return False, self.revision, upserts, deleted
+
+
+# 快照保留的历史版本数（batteries.json.1为上一版，依次类推）
+SNAPSHOT_GENERATIONS = 3
+
+
+def fsync_directory(directory):
+    """同步目录项，保证rename在断电后仍然有效（Windows不支持，直接跳过）"""
+    try:
+        fd = os.open(directory or '.', os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def rotate_generations(path, generations):
+    """把当前文件保留为path.1，已有的历史版本依次后移，超出数量的删除"""
+    if generations <= 0 or not os.path.exists(path):
+        return
+    oldest = f'{path}.{generations}'
+    if os.path.exists(oldest):
+        os.remove(oldest)
+    for i in range(generations - 1, 0, -1):
+        if os.path.exists(f'{path}.{i}'):
+            os.replace(f'{path}.{i}', f'{path}.{i + 1}')
+    # 用硬链接保留上一版，当前文件在任何时刻都存在
+    try:
+        os.link(path, f'{path}.1')
+    except OSError:
+        shutil.copyfile(path, f'{path}.1')
+
+
+def write_snapshot(path, data, generations=SNAPSHOT_GENERATIONS, fsync=True):
+    """
+    原子写入JSON文件：先写临时文件并fsync，保留历史版本后再rename替换，
+    任何时刻中断都不会留下写了一半的文件
+    """
+    write_snapshot_chunks(path, [json_dumps(data)], generations, fsync)
+
+
+def write_snapshot_chunks(path, chunks, generations=SNAPSHOT_GENERATIONS, fsync=True):
+    """与write_snapshot相同，内容由chunks逐段产出（bytes），写大文件时不必整体编码"""
+    tmp_file = path + '.tmp'
+    try:
+        with open(tmp_file, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+            f.flush()
+            if fsync:
+                os.fsync(f.fileno())
+        rotate_generations(path, generations)
+        os.replace(tmp_file, path)
+    except BaseException:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise
+    if fsync:
+        fsync_directory(os.path.dirname(path))
+
+
+class SnapshotCorruptError(ValueError):
+    """快照损坏且不允许回退到历史版本"""
+
+
+def read_snapshot(path, generations=SNAPSHOT_GENERATIONS, default=None, allow_fallback=True):
+    """
+    读取JSON文件，当前文件损坏时依次尝试历史版本，返回第一个有效的内容；
+    回退后损坏的文件改名为*.corrupt保留，避免下次写入时被轮换成历史版本。
+    allow_fallback为False时遇到损坏的文件抛出SnapshotCorruptError，不做任何改动；
+    全部不存在时返回default
+    """
+    candidates = [path] + [f'{path}.{i}' for i in range(1, generations + 1)]
+    corrupt = []
+    for candidate in candidates:
+        if not os.path.exists(candidate):
+            continue
+        try:
+            with open(candidate, 'rb') as f:
+                data = json_loads(f.read())
+        except (OSError, ValueError) as e:
+            if not allow_fallback:
+                raise SnapshotCorruptError(f"{candidate}已损坏: {e}")
+            print(f"{candidate}损坏，尝试上一版本: {e}")
+            corrupt.append(candidate)
+            continue
+        for bad in corrupt:
+            os.replace(bad, bad + '.corrupt')
+            print(f"损坏的{bad}已改名为{bad}.corrupt")
+        if candidate != path:
+            print(f"已从历史版本{candidate}恢复")
+        return data
+    if corrupt:
+        raise ValueError(f"{path}及其历史版本均已损坏")
+    return default
+
+
+class BatteryStore:
+    """
+    进程级电池记录存储
+    启动时加载一次batteries.json，读请求直接从内存返回。
+    每次修改以一行JSON追加到日志文件batteries.journal，
+    后台线程定期把内存数据压缩成新的batteries.json快照并清空已合并的日志，
+    启动时先加载快照再重放日志。
+    日志只保留最新快照之后的修改，快照损坏时回退到历史版本会丢失其间的修改、
+    已删除的记录也会重新出现，因此只有recover为True时才回退，否则抛出SnapshotCorruptError
+    """
+
+    def __init__(self, data_dir, compact_threshold=1000, compact_interval=60, fsync=True,
+                 generations=SNAPSHOT_GENERATIONS, recover=False):
+        self.batteries_file = os.path.join(data_dir, 'batteries.json')
+        self.settings_file = os.path.join(data_dir, 'settings.json')
+        self.journal_file = os.path.join(data_dir, 'batteries.journal')
+        self.compact_threshold = compact_threshold
+        self.compact_interval = compact_interval
+        self.fsync = fsync
+        self.generations = generations
+        self.recover = recover
+        self._lock = threading.RLock()
+        self._compact_lock = threading.Lock()
+        self._records = []
+        # 记录ID到其在_records中位置的索引
+        self._index = {}
+        self._last_id = 0
+        # 数据版本号，每次修改加1，用于缓存失效
+        self.version = 0
+        self.settings_version = 0
+        self.stats = None
+        self.code_index = None
+        self.text_index = None
+        self.value_index = None
+        self.changes = None
+        self._journal = None
+        self._journal_count = 0
+        self._compact_needed = threading.Event()
+        self._closed = False
+        self.load()
+
+        self._writer = threading.Thread(target=self._writer_loop, name='BatteryStoreWriter', daemon=True)
+        self._writer.start()
+
+    def load(self):
+        """加载快照并重放日志"""
+        with self._lock:
+            try:
+                self._records = read_snapshot(self.batteries_file, self.generations, default=[],
+                                              allow_fallback=self.recover)
+            except SnapshotCorruptError as e:
+                raise SnapshotCorruptError(
+                    f"{e}\n回退到历史版本会丢失该版本之后的修改，已删除的记录也可能重新出现。"
+                    f"确认后使用--recover参数（或环境变量RECOVER=1）启动以从历史版本恢复"
+                ) from None
+            self._reindex()
+
+            replayed = self._replay_journal()
+            for battery in self._records:
+                battery_id = str(battery.get('id', ''))
+                if battery_id.isdigit():
+                    self._last_id = max(self._last_id, int(battery_id))
+
+            self._journal = open(self.journal_file, 'ab')
+            self._journal_count = replayed
+            if not os.path.exists(self.batteries_file) and self._records:
+                # 从历史版本恢复后立即写出新快照，损坏的文件已改名
+                write_snapshot(self.batteries_file, self._records, self.generations, self.fsync)
+            self.stats = StatisticsAggregator(self._records)
+            self.code_index = PrefixIndex(self._records)
+            self.text_index = FullTextIndex(self._records)
+            self.value_index = ValueIndex(self._records)
+            self.changes = ChangeLog()
+
+        if replayed:
+            print(f"已从日志恢复{replayed}条修改")
+            self.compact()
+
+    def _replay_journal(self):
+        """重放日志，返回重放的条数；末尾写了一半的记录会被截掉"""
+        if not os.path.exists(self.journal_file):
+            return 0
+
+        count = 0
+        valid_size = 0
+        with open(self.journal_file, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    entry = json_loads(line)
+                except ValueError:
+                    break
+                self._apply(entry)
+                count += 1
+                valid_size += len(line)
+
+        if valid_size < os.path.getsize(self.journal_file):
+            print("日志末尾存在不完整的记录，已忽略")
+            with open(self.journal_file, 'r+b') as f:
+                f.truncate(valid_size)
+        return count
+
+    def all(self):
+        """返回全部记录（列表浅拷贝，记录本身只会被整体替换，不会原地修改）"""
+        with self._lock:
+            return list(self._records)
+
+    def query(self, criteria):
+        """按条件过滤、排序并分页，返回(当前页记录, 总数)"""
+        matched = self.select(criteria)
+        start = (criteria['page'] - 1) * criteria['page_size']
+        return matched[start:start + criteria['page_size']], len(matched)
+
+    def select(self, criteria):
+        """
+        按条件过滤并排序，返回全部匹配的记录（不分页）
+        按状态或型号过滤时先用等值索引取候选记录；关键字（子串匹配）和日期条件
+        没有可用的索引，只能逐条检查候选记录，没有状态和型号条件时为全表扫描
+        """
+        with self._lock:
+            positions = self._candidate_positions(criteria)
+            records = self._records if positions is None else [self._records[i] for i in positions]
+            matched = [b for b in records if record_matches(b, criteria)]
+
+        sort = criteria['sort']
+        if sort:
+            matched.sort(key=sort_key(sort.lstrip('-')), reverse=sort.startswith('-'))
+        return matched
+
+    def add(self, data):
+        """新增记录并返回新记录"""
+        with self._lock:
+            # 并发请求可能落在同一毫秒内，保证ID单调递增不重复
+            new_id = max(int(time.time() * 1000), self._last_id + 1)
+            self._last_id = new_id
+            entry = {'op': 'add', 'record': {**data, 'id': str(new_id)}}
+            return self._commit(entry)
+
+    def update(self, battery_id, data):
+        """合并更新记录，返回更新后的记录，未找到时返回None"""
+        with self._lock:
+            if self._find(battery_id) < 0:
+                return None
+            return self._commit({'op': 'update', 'id': battery_id, 'data': data})
+
+    def delete(self, battery_id):
+        """删除记录，返回是否删除成功"""
+        with self._lock:
+            if self._find(battery_id) < 0:
+                return False
+            return self._commit({'op': 'delete', 'id': battery_id})
+
+    def batch(self, operations):
+        """
+        批量新增/更新/删除，operations为parse_batch_operations的结果
+        整批作为一行日志写入（一次fsync），重放时要么全部生效要么全部丢弃；
+        任一目标记录不存在时抛出KeyError，不做任何修改
+        """
+        with self._lock:
+            check_batch_targets(operations, lambda battery_id: self._find(battery_id) >= 0)
+            entries = []
+            for op, battery_id, data in operations:
+                if op == 'create':
+                    new_id = max(int(time.time() * 1000), self._last_id + 1)
+                    self._last_id = new_id
+                    entries.append({'op': 'add', 'record': {**data, 'id': str(new_id)}})
+                elif op == 'update':
+                    entries.append({'op': 'update', 'id': battery_id, 'data': data})
+                else:
+                    entries.append({'op': 'delete', 'id': battery_id})
+            return self._commit({'op': 'batch', 'entries': entries})
+
+    def get_settings(self):
+        """读取系统设置"""
+        with _settings_lock:
+            return read_snapshot(self.settings_file, self.generations, default={})
+
+    def save_settings(self, data):
+        """保存系统设置"""
+        with _settings_lock:
+            write_snapshot(self.settings_file, data, self.generations, self.fsync)
+            self.settings_version += 1
+
+    def get(self, battery_id):
+        """按ID读取单条记录，未找到时返回None"""
+        with self._lock:
+            index = self._find(battery_id)
+            return self._records[index] if index >= 0 else None
+
+    def _find(self, battery_id):
+        return self._index.get(battery_id, -1)
+
+    def _candidate_positions(self, criteria):
+        """
+        等值索引给出的候选记录位置（按原顺序），没有可用条件或候选过多时返回None；
+        存在缺少ID或ID重复的记录时位置索引不完整，也返回None
+        """
+        if len(self._index) != len(self._records):
+            return None
+        ids = None
+        for key, field in VALUE_INDEX_FIELDS.items():
+            if criteria[key]:
+                found = self.value_index.lookup(field, criteria[key])
+                ids = found if ids is None else ids & found
+        # 候选记录较多时排序位置的开销超过逐条检查
+        if ids is None or len(ids) * 4 > len(self._records):
+            return None
+        return sorted(self._index[battery_id] for battery_id in ids)
+
+    def _reindex(self, start=0):
+        """重建从start开始的位置索引"""
+        for i in range(start, len(self._records)):
+            battery_id = self._records[i].get('id')
+            if battery_id is not None:
+                self._index[battery_id] = i
+
+    def _commit(self, entry):
+        """先写日志再修改内存"""
+        self._append_journal(entry)
+        self.version += 1
+        return self._apply(entry)
+
+    def _append_journal(self, entry):
+        self._journal.write(json_dumps(entry) + b'\n')
+        self._journal.flush()
+        if self.fsync:
+            os.fsync(self._journal.fileno())
+        self._journal_count += 1
+        if self._journal_count >= self.compact_threshold:
+            self._compact_needed.set()
+
+    def _apply(self, entry):
+        """把一条日志应用到内存数据，重放时可能重复应用，因此需要幂等"""
+        op = entry.get('op')
+        if op == 'batch':
+            return [self._apply(sub_entry) for sub_entry in entry['entries']]
+        if op == 'add':
+            record = entry['record']
+            index = self._find(record.get('id'))
+            if index >= 0:
+                old = self._records[index]
+                self._records[index] = record
+            else:
+                old = None
+                self._records.append(record)
+                self._index[record.get('id')] = len(self._records) - 1
+            self._on_change(old, record)
+            return record
+
+        index = self._find(entry.get('id'))
+        if op == 'update':
+            if index < 0:
+                return None
+            old = self._records[index]
+            # 请求体中的id不能改变记录ID，否则ID索引会指向改名后的记录
+            self._records[index] = {**old, **entry['data'], 'id': old.get('id')}
+            self._on_change(old, self._records[index])
+            return self._records[index]
+        if op == 'delete':
+            if index < 0:
+                return False
+            old = self._records.pop(index)
+            del self._index[entry.get('id')]
+            # 删除后其后记录的位置前移
+            self._reindex(index)
+            self._on_change(old, None)
+            return True
+        raise ValueError(f"未知的日志操作: {op}")
+
+    def _on_change(self, old, new):
+        """记录变化后更新派生数据；启动重放日志期间派生数据尚未建立"""
+        if self.stats is not None:
+            self.stats.replace(old, new)
+            self.code_index.replace(old, new)
+            self.text_index.replace(old, new)
+            self.value_index.replace(old, new)
+            self.changes.record((new or old).get('id'), change_operation(old, new))
+
+    def _writer_loop(self):
+        """后台线程：日志达到阈值或到达压缩周期时生成新快照"""
+        while not self._closed:
+            self._compact_needed.wait(self.compact_interval)
+            if self._closed:
+                break
+            self._compact_needed.clear()
+            try:
+                self.compact()
+            except Exception as e:
+                print(f"保存电池数据失败: {e}")
+
+    def compact(self):
+        """把内存数据写成新快照，并从日志中移除已包含在快照中的记录"""
+        with self._compact_lock:
+            with self._lock:
+                if self._journal_count == 0:
+                    return
+                records = list(self._records)
+                merged = self._journal_count
+                offset = self._journal.tell()
+
+            # 快照写入期间不持有锁，新的修改继续追加到日志末尾
+            write_snapshot(self.batteries_file, records, self.generations, self.fsync)
+
+            with self._lock:
+                self._journal.close()
+                with open(self.journal_file, 'rb') as f:
+                    f.seek(offset)
+                    tail = f.read()
+                tmp_journal = self.journal_file + '.tmp'
+                with open(tmp_journal, 'wb') as f:
+                    f.write(tail)
+                    if self.fsync:
+                        f.flush()
+                        os.fsync(f.fileno())
+                os.replace(tmp_journal, self.journal_file)
+                self._journal = open(self.journal_file, 'ab')
+                self._journal_count -= merged
+
+    def flush(self):
+        """立即把内存中的记录写回快照"""
+        self.compact()
+
+    def close(self):
+        """停止后台线程，写回快照并关闭日志"""
+        if self._closed:
+            return
+        self.compact()
+        self._closed = True
+        self._compact_needed.set()
+        with self._lock:
+            self._journal.close()
+
+
+class SQLiteBatteryStore:
+    """
+    SQLite电池记录存储（可选引擎）
+    完整记录以JSON保存在data列中，常用查询字段单独成列并建立索引，
+    接口与BatteryStore一致，REST API无需区分存储引擎
+    """
+
+    INDEXED_FIELDS = ('batteryBtCode', 'bmsNumber', 'repairStatus', 'returnDate', 'batteryModel')
+    # 由记录计算的列：returnDay为规范化的返厂时间（见normalize_day）
+    DERIVED_COLUMNS = ('returnDay',)
+    COLUMNS = INDEXED_FIELDS + DERIVED_COLUMNS
+
+    def __init__(self, data_dir, db_file=None, recover=False):
+        self.data_dir = data_dir
+        self.recover = recover
+        self.db_file = db_file or os.path.join(data_dir, 'batteries.db')
+        self._lock = threading.RLock()
+        self._last_id = 0
+        self.version = 0
+        self.settings_version = 0
+
+        is_new = not os.path.exists(self.db_file)
+        self._conn = sqlite3.connect(self.db_file, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._create_schema()
+        if is_new:
+            self.migrate_from_json()
+
+        row = self._conn.execute("SELECT MAX(CAST(id AS INTEGER)) FROM batteries WHERE id GLOB '[0-9]*'").fetchone()
+        self._last_id = row[0] or 0
+        records = self.all()
+        self.stats = StatisticsAggregator(records)
+        self.code_index = PrefixIndex(records)
+        self.text_index = FullTextIndex(records)
+        self.changes = ChangeLog()
+
+    def _create_schema(self):
+        columns = ', '.join(f'{field} TEXT' for field in self.COLUMNS)
+        with self._conn:
+            self._conn.execute(
+                f'CREATE TABLE IF NOT EXISTS batteries (id TEXT PRIMARY KEY, {columns}, data TEXT NOT NULL)'
+            )
+            # 旧版本创建的数据库缺少计算列，补上并回填
+            existing = {row[1] for row in self._conn.execute('PRAGMA table_info(batteries)')}
+            missing = [column for column in self.DERIVED_COLUMNS if column not in existing]
+            for column in missing:
+                self._conn.execute(f'ALTER TABLE batteries ADD COLUMN {column} TEXT')
+            if missing:
+                rows = self._conn.execute('SELECT id, data FROM batteries').fetchall()
+                self._conn.executemany(
+                    'UPDATE batteries SET returnDay = ? WHERE id = ?',
+                    [(normalize_day(json_loads(data).get('returnDate')), battery_id) for battery_id, data in rows]
+                )
+            for field in self.COLUMNS:
+                self._conn.execute(f'CREATE INDEX IF NOT EXISTS idx_batteries_{field} ON batteries ({field})')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+
+    def migrate_from_json(self):
+        """一次性从batteries.json（含未压缩的日志）和settings.json导入数据"""
+        records = []
+        if os.path.exists(os.path.join(self.data_dir, 'batteries.json')):
+            json_store = BatteryStore(self.data_dir, recover=self.recover)
+            records = json_store.all()
+            json_store.close()
+
+        settings = read_snapshot(os.path.join(self.data_dir, 'settings.json'))
+
+        with self._lock, self._conn:
+            self._conn.executemany(self._upsert_sql(), [self._row(record) for record in records])
+            if settings is not None:
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)',
+                    ('settings', json_dumps(settings).decode('utf-8'))
+                )
+        print(f"已从JSON文件迁移{len(records)}条记录到SQLite")
+
+    def _upsert_sql(self):
+        columns = ', '.join(('id',) + self.COLUMNS + ('data',))
+        placeholders = ', '.join('?' * (len(self.COLUMNS) + 2))
+        return f'INSERT OR REPLACE INTO batteries ({columns}) VALUES ({placeholders})'
+
+    def _row(self, record):
+        values = [record.get('id')]
+        for field in self.INDEXED_FIELDS:
+            value = record.get(field)
+            values.append(None if value is None else str(value))
+        values.append(normalize_day(record.get('returnDate')))
+        values.append(json_dumps(record).decode('utf-8'))
+        return values
+
+    def all(self):
+        """按插入顺序返回全部记录"""
+        with self._lock:
+            rows = self._conn.execute('SELECT data FROM batteries ORDER BY rowid').fetchall()
+        return [json_loads(row[0]) for row in rows]
+
+    def get(self, battery_id):
+        """按ID读取单条记录"""
+        with self._lock:
+            row = self._conn.execute('SELECT data FROM batteries WHERE id = ?', (battery_id,)).fetchone()
+        return json_loads(row[0]) if row else None
+
+    def query(self, criteria):
+        """按条件过滤、排序并分页，返回(当前页记录, 总数)，过滤和排序都在SQLite中完成"""
+        where, params, order = self._where(criteria)
+        offset = (criteria['page'] - 1) * criteria['page_size']
+        with self._lock:
+            total = self._conn.execute(f'SELECT COUNT(*) FROM batteries{where}', params).fetchone()[0]
+            rows = self._conn.execute(
+                f'SELECT data FROM batteries{where} ORDER BY {order} LIMIT ? OFFSET ?',
+                params + [criteria['page_size'], offset]
+            ).fetchall()
+        return [json_loads(row[0]) for row in rows], total
+
+    def select(self, criteria, batch_size=1000):
+        """
+        按条件过滤并排序，逐条产出全部匹配的记录（不分页）
+        使用单独的只读连接，WAL模式下读取的是一致的快照，导出期间不阻塞写入
+        """
+        where, params, order = self._where(criteria)
+        conn = sqlite3.connect(self.db_file, check_same_thread=False)
+        try:
+            cursor = conn.execute(f'SELECT data FROM batteries{where} ORDER BY {order}', params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield json_loads(row[0])
+        finally:
+            conn.close()
+
+    def _where(self, criteria):
+        """查询条件对应的WHERE子句、参数和ORDER BY子句"""
+        conditions = []
+        params = []
+        if criteria['status']:
+            conditions.append('repairStatus = ?')
+            params.append(criteria['status'])
+        if criteria['model']:
+            conditions.append('batteryModel = ?')
+            params.append(criteria['model'])
+        if criteria['q']:
+            pattern = '%' + re.sub(r'([%_\\])', r'\\\1', criteria['q']) + '%'
+            conditions.append('(' + ' OR '.join(
+                f"LOWER({self._column(field)}) LIKE ? ESCAPE '\\'" for field in SEARCH_FIELDS
+            ) + ')')
+            params.extend([pattern] * len(SEARCH_FIELDS))
+        if criteria['date_from'] or criteria['date_to']:
+            # 与record_matches一致：没有返厂时间的记录保留，无法解析的（空字符串）排除
+            in_range = ["returnDay != ''"]
+            if criteria['date_from']:
+                in_range.append('returnDay >= ?')
+                params.append(criteria['date_from'].isoformat())
+            if criteria['date_to']:
+                in_range.append('returnDay <= ?')
+                params.append(criteria['date_to'].isoformat())
+            conditions.append(f"(returnDay IS NULL OR ({' AND '.join(in_range)}))")
+        where = ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+
+        order = 'rowid'
+        sort = criteria['sort']
+        if sort:
+            direction = 'DESC' if sort.startswith('-') else 'ASC'
+            field = sort.lstrip('-')
+            if field in NUMERIC_SORT_FIELDS:
+                # CAST取开头的数字，与parse_number一致
+                key = f"COALESCE(CAST(json_extract(data, '$.{field}') AS REAL), 0)"
+            elif field == 'returnDate':
+                key = "COALESCE(returnDay, '')"
+            else:
+                key = f"COALESCE({self._column(field)}, '')"
+            order = f"{key} {direction}, rowid"
+        return where, params, order
+
+    def _column(self, field):
+        """字段对应的SQL表达式，未建索引的字段从JSON中提取"""
+        if field in self.INDEXED_FIELDS or field == 'id':
+            return field
+        if not _FIELD_NAME_RE.fullmatch(field):
+            raise ValueError(f'无效的字段名: {field}')
+        return f"CAST(json_extract(data, '$.{field}') AS TEXT)"
+
+    def find_by(self, field, value):
+        """按索引字段精确查找记录"""
+        if field not in self.INDEXED_FIELDS:
+            raise ValueError(f"字段没有索引: {field}")
+        with self._lock:
+            rows = self._conn.execute(
+                f'SELECT data FROM batteries WHERE {field} = ? ORDER BY rowid', (value,)
+            ).fetchall()
+        return [json_loads(row[0]) for row in rows]
+
+    def add(self, data):
+        """新增记录并返回新记录"""
+        with self._lock:
+            new_id = max(int(time.time() * 1000), self._last_id + 1)
+            self._last_id = new_id
+            new_battery = {**data, 'id': str(new_id)}
+            with self._conn:
+                self._conn.execute(self._upsert_sql(), self._row(new_battery))
+            self._on_change(None, new_battery)
+            return new_battery
+
+    def update(self, battery_id, data):
+        """合并更新记录，返回更新后的记录，未找到时返回None"""
+        with self._lock:
+            battery = self.get(battery_id)
+            if battery is None:
+                return None
+            updated = {**battery, **data, 'id': battery_id}
+            assignments = ', '.join(f'{field} = ?' for field in self.COLUMNS + ('data',))
+            with self._conn:
+                self._conn.execute(
+                    f'UPDATE batteries SET {assignments} WHERE id = ?',
+                    self._row(updated)[1:] + [battery_id]
+                )
+            self._on_change(battery, updated)
+            return updated
+
+    def delete(self, battery_id):
+        """删除记录，返回是否删除成功"""
+        with self._lock:
+            battery = self.get(battery_id)
+            if battery is None:
+                return False
+            with self._conn:
+                self._conn.execute('DELETE FROM batteries WHERE id = ?', (battery_id,))
+            self._on_change(battery, None)
+            return True
+
+    def batch(self, operations):
+        """
+        批量新增/更新/删除，operations为parse_batch_operations的结果
+        整批在一个事务中提交，任一目标记录不存在时抛出KeyError，不做任何修改
+        """
+        with self._lock:
+            check_batch_targets(operations, lambda battery_id: self.get(battery_id) is not None)
+            changes = []
+            current = {}
+            assignments = ', '.join(f'{field} = ?' for field in self.COLUMNS + ('data',))
+            with self._conn:
+                for op, battery_id, data in operations:
+                    if op == 'create':
+                        new_id = max(int(time.time() * 1000), self._last_id + 1)
+                        self._last_id = new_id
+                        new_battery = {**data, 'id': str(new_id)}
+                        self._conn.execute(self._upsert_sql(), self._row(new_battery))
+                        changes.append((None, new_battery))
+                        continue
+
+                    battery = current[battery_id] if battery_id in current else self.get(battery_id)
+                    if op == 'update':
+                        updated = {**battery, **data, 'id': battery_id}
+                        self._conn.execute(
+                            f'UPDATE batteries SET {assignments} WHERE id = ?',
+                            self._row(updated)[1:] + [battery_id]
+                        )
+                        current[battery_id] = updated
+                        changes.append((battery, updated))
+                    else:
+                        self._conn.execute('DELETE FROM batteries WHERE id = ?', (battery_id,))
+                        current[battery_id] = None
+                        changes.append((battery, None))
+
+            for old, new in changes:
+                self._on_change(old, new)
+            return [True if new is None else new for _, new in changes]
+
+    def _on_change(self, old, new):
+        """记录变化后更新版本号和派生数据"""
+        self.version += 1
+        self.stats.replace(old, new)
+        self.code_index.replace(old, new)
+        self.text_index.replace(old, new)
+        self.changes.record((new or old).get('id'), change_operation(old, new))
+
+    def get_settings(self):
+        """读取系统设置"""
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM settings WHERE key = 'settings'").fetchone()
+        if row is None:
+            # 数据库中还没有设置时使用默认的settings.json
+            with _settings_lock:
+                return read_snapshot(os.path.join(self.data_dir, 'settings.json'), default={})
+        return json_loads(row[0])
+
+    def save_settings(self, data):
+        """保存系统设置"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)',
+                ('settings', json_dumps(data).decode('utf-8'))
+            )
+            self.settings_version += 1
+
+    def flush(self):
+        """SQLite每次修改都已提交，无需额外写回"""
+
+    def close(self):
+        """关闭数据库连接"""
+        with self._lock:
+            self._conn.close()
+
+
+IMAGE_FIELDS = ('beforeRepairImages', 'afterRepairImages')
+MAX_IMAGE_SIZE = 20 * 1024 * 1024
+_IMAGE_HASH_RE = re.compile(r'[0-9a-f]{64}')
+_IMAGE_SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'BM', 'image/bmp'),
+)
+
+
+class ImageStore:
+    """
+    按内容寻址的图片存储
+    图片原始字节以SHA-256为文件名保存在data/images下（按前两位分目录），
+    相同内容只保存一份
+    """
+
+    def __init__(self, data_dir):
+        self.images_dir = os.path.join(data_dir, 'images')
+        os.makedirs(self.images_dir, exist_ok=True)
+
+    def path(self, image_hash):
+        return os.path.join(self.images_dir, image_hash[:2], image_hash)
+
+    def exists(self, image_hash):
+        return bool(_IMAGE_HASH_RE.fullmatch(image_hash or '')) and os.path.exists(self.path(image_hash))
+
+    def put(self, data):
+        """保存图片，返回SHA-256；内容已存在时直接返回"""
+        image_hash = hashlib.sha256(data).hexdigest()
+        target = self.path(image_hash)
+        if not os.path.exists(target):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            # 先写临时文件再改名，并发上传同一张图片时也不会读到半个文件
+            tmp_file = f'{target}.{threading.get_ident()}.tmp'
+            with open(tmp_file, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_file, target)
+        return image_hash
+
+    @staticmethod
+    def content_type(head):
+        """根据文件头判断图片类型"""
+        for signature, content_type in _IMAGE_SIGNATURES:
+            if head.startswith(signature):
+                return content_type
+        if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+            return 'image/webp'
+        return 'application/octet-stream'
+
+
+# 缩略图固定尺寸（最长边像素）
+THUMBNAIL_SIZES = (160, 320, 640)
+MAX_THUMBNAIL_CACHE_BYTES = 200 * 1024 * 1024
+
+
+class ThumbnailCache:
+    """
+    图片缩略图的磁盘缓存
+    首次请求时用Pillow生成JPEG缩略图保存在data/thumbnails/<尺寸>/下，
+    总大小超过上限时按最近最少使用淘汰。未安装Pillow时不生成缩略图
+    """
+
+    def __init__(self, data_dir, images, max_bytes=MAX_THUMBNAIL_CACHE_BYTES):
+        self.thumbnails_dir = os.path.join(data_dir, 'thumbnails')
+        self.images = images
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+
+        try:
+            from PIL import Image  # type: ignore
+            self._image_module = Image
+        except ImportError:
+            self._image_module = None
+            print('缩略图功能需要安装Pillow库，当前将直接返回原图')
+            print('请运行: pip install Pillow')
+
+        self._load_entries()
+
+    @property
+    def available(self):
+        return self._image_module is not None
+
+    def _load_entries(self):
+        """启动时按修改时间恢复LRU顺序"""
+        if not os.path.isdir(self.thumbnails_dir):
+            return
+        entries = []
+        for size_dir in os.listdir(self.thumbnails_dir):
+            directory = os.path.join(self.thumbnails_dir, size_dir)
+            if not os.path.isdir(directory):
+                continue
+            for name in os.listdir(directory):
+                path = os.path.join(directory, name)
+                if name.endswith('.tmp'):
+                    os.remove(path)
+                    continue
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, path, stat.st_size))
+        for _, path, size in sorted(entries):
+            self._entries[path] = size
+            self._total_bytes += size
+        self._evict()
+
+    def path(self, image_hash, size):
+        return os.path.join(self.thumbnails_dir, str(size), f'{image_hash}.jpg')
+
+    def open(self, image_hash, size):
+        """
+        返回已打开的缩略图文件，需要时先生成
+        文件在持有锁时打开，其他线程随后淘汰它也不影响本次读取
+        """
+        path = self.path(image_hash, size)
+        with self._lock:
+            if path in self._entries:
+                try:
+                    f = open(path, 'rb')
+                except FileNotFoundError:
+                    self._total_bytes -= self._entries.pop(path)
+                else:
+                    self._entries.move_to_end(path)
+                    os.utime(path)
+                    return f
+
+        # 生成缩略图不持有锁，同一张图并发生成时后写入的覆盖先写入的
+        tmp_file = self._generate(self.images.path(image_hash), path, size)
+
+        # 淘汰只在持有锁时进行，替换后立即打开不会被其他线程删除
+        with self._lock:
+            os.replace(tmp_file, path)
+            f = open(path, 'rb')
+            file_size = os.fstat(f.fileno()).st_size
+            self._total_bytes += file_size - self._entries.pop(path, 0)
+            self._entries[path] = file_size
+            self._evict()
+        return f
+
+    def _generate(self, source, target, size):
+        """生成缩略图到临时文件，返回临时文件路径，由调用方替换到target"""
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with self._image_module.open(source) as image:
+            image.thumbnail((size, size))
+            if image.mode != 'RGB':
+                image = image.convert('RGB')
+            tmp_file = f'{target}.{threading.get_ident()}.tmp'
+            image.save(tmp_file, 'JPEG', quality=80, optimize=True)
+        return tmp_file
+
+    def _evict(self):
+        while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+            path, file_size = self._entries.popitem(last=False)
+            self._total_bytes -= file_size
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def image_url(image_hash):
+    return f'/api/images/{image_hash}'
+
+
+def decode_data_url(data_url):
+    """解码base64图片data URL，内容不是有效的base64或为空时抛出ValueError"""
+    try:
+        data = base64.b64decode(data_url.split(',', 1)[1], validate=True)
+    except binascii.Error:
+        raise ValueError('图片不是有效的base64数据')
+    if not data:
+        raise ValueError('图片内容为空')
+    return data
+
+
+def externalize_images(record, images, strict=True):
+    """
+    把记录中内嵌的base64图片存入图片库，图片的data改为图片地址并记录hash
+    前端仍然用image.data作为<img>的src，无需修改。没有内嵌图片时原样返回。
+    图片数据无效时strict为True抛出ValueError，否则保留原样
+    """
+    changes = {}
+    for field in IMAGE_FIELDS:
+        entries = record.get(field)
+        if not isinstance(entries, list):
+            continue
+
+        converted = []
+        changed = False
+        for entry in entries:
+            data_url = entry.get('data') if isinstance(entry, dict) else entry
+            if isinstance(data_url, str) and data_url.startswith('data:') and ';base64,' in data_url:
+                try:
+                    image_hash = images.put(decode_data_url(data_url))
+                except ValueError as e:
+                    if strict:
+                        raise ValueError(f'{field}: {e}')
+                    converted.append(entry)
+                    continue
+                if isinstance(entry, dict):
+                    entry = {**entry, 'data': image_url(image_hash), 'hash': image_hash}
+                else:
+                    entry = image_url(image_hash)
+                changed = True
+            converted.append(entry)
+
+        if changed:
+            changes[field] = converted
+
+    return {**record, **changes} if changes else record
+
+
+def migrate_embedded_images(store, images):
+    """一次性迁移：把已有记录中内嵌的图片移入图片库，返回迁移的记录数"""
+    migrated = 0
+    skipped = 0
+    for record in store.all():
+        # 历史数据中无效的图片保留原样，不影响启动
+        converted = externalize_images(record, images, strict=False)
+        if converted is not record:
+            # 没有ID的记录无法更新，保留内嵌图片
+            if record.get('id') is None:
+                skipped += 1
+                continue
+            store.update(record['id'], {field: converted[field] for field in IMAGE_FIELDS if field in converted})
+            migrated += 1
+    if migrated:
+        print(f"已把{migrated}条记录中的内嵌图片迁移到图片库")
+    if skipped:
+        print(f"{skipped}条没有ID的记录中的内嵌图片未迁移")
+    return migrated
+
+
+_statistics_cache = {'key': None, 'data': None}
+_statistics_lock = threading.Lock()
+
+
+def get_statistics(store):
+    """返回统计数据，数据版本和日期不变时直接使用缓存"""
+    today = datetime.date.today()
+    with _statistics_lock:
+        key = (id(store), store.version, today)
+        if _statistics_cache['key'] != key:
+            _statistics_cache['data'] = store.stats.snapshot(today)
+            _statistics_cache['key'] = key
+        return _statistics_cache['data']
+
+
+# 字段投影：summary为列表、统计和下拉框使用的精简记录，去掉图片和长文本
+SUMMARY_EXCLUDED_FIELDS = IMAGE_FIELDS + FULLTEXT_FIELDS
+SUMMARY_PROJECTION = (None, frozenset(SUMMARY_EXCLUDED_FIELDS))
+
+
+def parse_projection(params):
+    """
+    解析fields=和exclude=参数（逗号分隔的字段名），返回(保留字段, 排除字段)，都没有时返回None
+    fields=summary表示精简记录；指定fields时始终保留id
+    """
+    def names(key):
+        values = ','.join(params.get(key, []))
+        result = [name.strip() for name in values.split(',') if name.strip()]
+        for name in result:
+            if not _FIELD_NAME_RE.fullmatch(name):
+                raise ValueError(f'无效的字段名: {name}')
+        return result
+
+    fields = names('fields')
+    exclude = names('exclude')
+    if not fields and not exclude:
+        return None
+    if fields == ['summary']:
+        return (None, SUMMARY_PROJECTION[1] | frozenset(exclude))
+    return (tuple(dict.fromkeys(['id'] + fields)) if fields else None, frozenset(exclude))
+
+
+def project_record(record, projection):
+    """按投影裁剪单条记录，返回新字典，原记录不变"""
+    if projection is None:
+        return record
+    fields, exclude = projection
+    if fields is not None:
+        return {field: record[field] for field in fields if field in record and field not in exclude}
+    return {field: value for field, value in record.items() if field not in exclude}
+
+
+def project_records(records, projection):
+    if projection is None:
+        return records
+    return [project_record(record, projection) for record in records]
+
+
+_summary_cache = {'key': None, 'data': None}
+_summary_lock = threading.Lock()
+
+
+def get_summary_records(store):
+    """返回全部记录的精简版本，数据版本不变时直接使用缓存"""
+    with _summary_lock:
+        key = (id(store), store.version)
+        if _summary_cache['key'] != key:
+            _summary_cache['data'] = project_records(store.all(), SUMMARY_PROJECTION)
+            _summary_cache['key'] = key
+        return _summary_cache['data']
+
+
+# 导出的列（表头与records.js中exportToCSV/exportToExcel一致）
+EXPORT_COLUMNS = (
+    ('电池BT码', 'batteryBtCode'), ('BMS编号', 'bmsNumber'), ('电池型号', 'batteryModel'),
+    ('循环次数', 'cycleCount'), ('返厂原因', 'returnReason'), ('返厂时间', 'returnDate'),
+    ('客退地区', 'returnArea'), ('维修状态', 'repairStatus'), ('维修项目', 'repairItem'),
+    ('维修费用', 'repairCost'), ('维修时间', 'repairDate'), ('快递公司', 'expressCompany'),
+    ('运费金额', 'shippingCost'), ('责任归属', 'responsibility'), ('维修工时费', 'laborCost'),
+    ('原因分析', 'causeAnalysis'), ('改善措施', 'improvements'), ('维修措施', 'repairMeasures'),
+)
+EXPORT_FORMATS = ('csv', 'xlsx')
+# CSV每攒够这么多行发送一次
+EXPORT_CSV_BATCH = 500
+
+
+def export_row(record):
+    return ['' if record.get(field) is None else str(record.get(field)) for _, field in EXPORT_COLUMNS]
+
+
+def iter_csv_export(records):
+    """逐批产出CSV文本，带BOM以便Excel正确识别中文"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write('\ufeff')
+    writer.writerow([header for header, _ in EXPORT_COLUMNS])
+    for i, record in enumerate(records, 1):
+        writer.writerow(export_row(record))
+        if i % EXPORT_CSV_BATCH == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def write_xlsx_export(records, f):
+    """
+    以openpyxl只写模式把记录写入Excel文件对象f
+    注意：这个函数需要openpyxl库来处理Excel文件
+    如果没有安装，请运行: pip install openpyxl
+    """
+    from openpyxl import Workbook  # type: ignore
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('电池维修记录')
+    sheet.append([header for header, _ in EXPORT_COLUMNS])
+    for record in records:
+        sheet.append(export_row(record))
+    workbook.save(f)
+
+
+# 响应压缩
+MIN_COMPRESS_SIZE = 1024
+COMPRESSIBLE_EXTENSIONS = ('.js', '.css', '.html', '.json', '.csv', '.svg')
+# 启动时预压缩并缓存的静态资源，其余可压缩文件（如data/下的数据文件）按需以动态压缩级别压缩
+PRECOMPRESSED_EXTENSIONS = ('.js', '.css', '.html')
+# 超过该大小的非预压缩文件不压缩，避免在请求线程中压缩大文件
+MAX_DYNAMIC_COMPRESS_SIZE = 8 * 1024 * 1024
+
+
+def supported_encodings():
+    """服务器支持的压缩格式，按优先级排列"""
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def choose_encoding(accept_encoding):
+    """根据Accept-Encoding选择压缩格式，不支持时返回None"""
+    if not accept_encoding:
+        return None
+    accepted = set()
+    for item in accept_encoding.split(','):
+        name, _, params = item.strip().partition(';')
+        q = params.strip()
+        if q.startswith('q=') and q[2:].strip() in ('0', '0.0', '0.00', '0.000'):
+            continue
+        accepted.add(name.strip().lower())
+    for encoding in supported_encodings():
+        if encoding in accepted or '*' in accepted:
+            return encoding
+    return None
+
+
+def compress(data, encoding, static=False):
+    """压缩响应体，静态文件只压缩一次，使用最高压缩率"""
+    if encoding == 'br':
+        return brotli.compress(data, quality=11 if static else 5)
+    return gzip.compress(data, compresslevel=9 if static else 6, mtime=0)
+
+
+# 列表记录数达到该值时分块流式发送
+STREAM_MIN_RECORDS = 1000
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def iter_json_array(records):
+    """逐条编码JSON数组，输出与json_dumps(records)相同"""
+    yield b'['
+    for i, record in enumerate(records):
+        if i:
+            yield b','
+        yield json_dumps(record)
+    yield b']'
+
+
+def iter_ndjson(records):
+    """每条记录一行JSON，客户端可以边接收边解析"""
+    for record in records:
+        yield json_dumps(record) + b'\n'
+
+
+def iter_msgpack_array(records):
+    """逐条编码MessagePack数组"""
+    packer = msgpack.Packer(use_bin_type=True)
+    yield packer.pack_array_header(len(records))
+    for record in records:
+        yield packer.pack(record)
+
+
+# 可协商的响应格式: Accept中的媒体类型 -> 格式
+RESPONSE_FORMATS = {
+    'application/json': 'json',
+    'application/x-ndjson': 'ndjson',
+    'application/ndjson': 'ndjson',
+    'application/x-msgpack': 'msgpack',
+    'application/msgpack': 'msgpack',
+    'application/vnd.msgpack': 'msgpack',
+}
+FORMAT_CONTENT_TYPES = {
+    'json': 'application/json; charset=utf-8',
+    'ndjson': 'application/x-ndjson; charset=utf-8',
+    'msgpack': 'application/x-msgpack',
+}
+
+
+def choose_response_format(accept):
+    """
+    根据Accept选择响应格式（json/ndjson/msgpack），按q值优先，q相同时取先出现的；
+    未安装msgpack或没有可用格式时返回json
+    """
+    best, best_q = 'json', -1.0
+    for item in (accept or '').split(','):
+        media_type, _, params = item.strip().partition(';')
+        fmt = RESPONSE_FORMATS.get(media_type.strip().lower())
+        if fmt is None or (fmt == 'msgpack' and msgpack is None):
+            continue
+        q = 1.0
+        for param in params.split(';'):
+            name, _, value = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if q > best_q and q > 0:
+            best, best_q = fmt, q
+    return best
+
+
+def format_etag(etag, fmt):
+    """不同响应格式的内容不同，强ETag需要区分"""
+    return etag if fmt == 'json' else f'{etag[:-1]}-{fmt}"'
+
+
+class StreamCompressor:
+    """增量压缩，用于分块发送的响应"""
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        if encoding == 'br':
+            self._compressor = brotli.Compressor(quality=5)
+        else:
+            self._compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        if self.encoding == 'br':
+            return self._compressor.process(data)
+        return self._compressor.compress(data)
+
+    def finish(self):
+        if self.encoding == 'br':
+            return self._compressor.finish()
+        return self._compressor.flush()
+
+
+def encoded_etag(etag, encoding):
+    """同一资源不同压缩格式的内容不同，强ETag需要区分"""
+    return f'{etag[:-1]}-{encoding}"'
+
+
+class StaticCompressionCache:
+    """
+    静态文件的预压缩缓存
+    只缓存启动时根目录下的.js/.css/.html文件，按修改时间和大小判断是否需要重新压缩
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._paths = set()
+
+    def warm(self, root):
+        """预压缩根目录下的静态文件，返回文件数"""
+        paths = [
+            os.path.join(root, name) for name in os.listdir(root)
+            if os.path.isfile(os.path.join(root, name)) and name.lower().endswith(PRECOMPRESSED_EXTENSIONS)
+        ]
+        with self._lock:
+            self._paths.update(paths)
+        for path in paths:
+            for encoding in supported_encodings():
+                self.get(path, encoding)
+        return len(paths)
+
+    def __contains__(self, path):
+        """path是否属于预压缩的静态资源"""
+        with self._lock:
+            return path in self._paths
+
+    def get(self, path, encoding):
+        """返回(压缩后的内容, 原文件stat)"""
+        stat = os.stat(path)
+        key = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry and entry[0] == key and encoding in entry[1]:
+                return entry[1][encoding], stat
+
+        with open(path, 'rb') as f:
+            data = compress(f.read(), encoding, static=True)
+
+        with self._lock:
+            entry = self._entries.get(path)
+            if not entry or entry[0] != key:
+                entry = (key, {})
+                self._entries[path] = entry
+            entry[1][encoding] = data
+        return data, stat
+
+
+_static_cache = StaticCompressionCache()
+
+
+# 事件推送的心跳间隔（秒），防止代理或浏览器断开空闲连接
+EVENT_KEEPALIVE_INTERVAL = 15
+# 单个客户端未发出的数据上限，超出说明客户端太慢，直接断开
+MAX_EVENT_BUFFER = 1024 * 1024
+
+
+class EventBroadcaster:
+    """
+    Server-Sent Events推送
+    处理线程发送完响应头后把连接交给这里，由单个后台线程用selectors统一写出，
+    空闲连接不占用工作线程；每个连接各自缓冲，慢客户端不会拖慢其他客户端
+    """
+
+    def __init__(self, keepalive_interval=EVENT_KEEPALIVE_INTERVAL, max_buffer=MAX_EVENT_BUFFER):
+        self.keepalive_interval = keepalive_interval
+        self.max_buffer = max_buffer
+        self._lock = threading.Lock()
+        self._clients = {}
+        self._selector = selectors.DefaultSelector()
+        self._wakeup_recv, self._wakeup_send = socket.socketpair()
+        self._wakeup_recv.setblocking(False)
+        self._wakeup_send.setblocking(False)
+        self._selector.register(self._wakeup_recv, selectors.EVENT_READ)
+        self._thread = threading.Thread(target=self._run, name='EventBroadcaster', daemon=True)
+        self._thread.start()
+
+    @property
+    def client_count(self):
+        with self._lock:
+            return len(self._clients)
+
+    def add_client(self, conn, initial=b''):
+        """接管一个已发送响应头的连接"""
+        conn.setblocking(False)
+        with self._lock:
+            self._clients[conn] = bytearray(initial)
+        self._wake()
+
+    def publish(self, event, data):
+        """向所有连接广播一条事件"""
+        message = format_event(event, data, data.get('revision'))
+        with self._lock:
+            for conn, buffer in self._clients.items():
+                buffer += message
+        self._wake()
+
+    def publish_change(self, battery_id, revision, operation):
+        """ChangeLog的监听函数"""
+        self.publish('change', {'id': battery_id, 'revision': revision, 'op': operation})
+
+    def _wake(self):
+        try:
+            self._wakeup_send.send(b'\0')
+        except (BlockingIOError, OSError):
+            # 唤醒管道已满说明后台线程马上会处理
+            pass
+
+    def _run(self):
+        last_keepalive = time.monotonic()
+        while True:
+            with self._lock:
+                for conn, buffer in self._clients.items():
+                    events = selectors.EVENT_READ | (selectors.EVENT_WRITE if buffer else 0)
+                    try:
+                        self._selector.modify(conn, events)
+                    except KeyError:
+                        self._selector.register(conn, events)
+
+            for key, mask in self._selector.select(self.keepalive_interval):
+                conn = key.fileobj
+                if conn is self._wakeup_recv:
+                    try:
+                        while conn.recv(4096):
+                            pass
+                    except (BlockingIOError, OSError):
+                        pass
+                    continue
+                if mask & selectors.EVENT_READ:
+                    # 客户端不会再发送数据，可读说明已断开
+                    try:
+                        if not conn.recv(4096):
+                            self._remove(conn)
+                            continue
+                    except BlockingIOError:
+                        pass
+                    except OSError:
+                        self._remove(conn)
+                        continue
+                if mask & selectors.EVENT_WRITE:
+                    self._flush(conn)
+
+            now = time.monotonic()
+            if now - last_keepalive >= self.keepalive_interval:
+                last_keepalive = now
+                with self._lock:
+                    for buffer in self._clients.values():
+                        buffer += b': keepalive\n\n'
+
+            with self._lock:
+                slow = [conn for conn, buffer in self._clients.items() if len(buffer) > self.max_buffer]
+            for conn in slow:
+                self._remove(conn)
+
+    def _flush(self, conn):
+        with self._lock:
+            buffer = self._clients.get(conn)
+            if not buffer:
+                return
+            try:
+                sent = conn.send(buffer)
+            except BlockingIOError:
+                return
+            except OSError:
+                sent = None
+            if sent is not None:
+                del buffer[:sent]
+                return
+        self._remove(conn)
+
+    def _remove(self, conn):
+        with self._lock:
+            self._clients.pop(conn, None)
+        try:
+            self._selector.unregister(conn)
+        except (KeyError, ValueError):
+            pass
+        try:
+            conn.close()
+        except OSError:
+            pass
+
+
+def format_event(event, data, event_id=None):
+    """编码一条SSE事件"""
+    lines = []
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'event: {event}')
+    lines.append('data: ' + json_dumps(data).decode('utf-8'))
+    return ('\n'.join(lines) + '\n\n').encode('utf-8')
+
+
+_battery_store = None
+_battery_store_lock = threading.Lock()
+
+# 存储引擎: json（默认）或 sqlite
+STORAGE_ENGINES = ('json', 'sqlite')
+_storage_engine = os.environ.get('STORAGE', 'json')
+# 快照损坏时是否允许回退到历史版本（会丢失其间的修改）
+_recover_snapshot = os.environ.get('RECOVER', '') == '1'
+
+
+_image_store = None
+_thumbnail_cache = None
+_event_broadcaster = None
+
+
+def get_battery_store(data_dir):
+    """获取进程级电池记录存储（首次调用时创建）"""
+    global _battery_store
+    if _battery_store is None:
+        with _battery_store_lock:
+            if _battery_store is None:
+                if _storage_engine == 'sqlite':
+                    store = SQLiteBatteryStore(data_dir, recover=_recover_snapshot)
+                else:
+                    store = BatteryStore(data_dir, recover=_recover_snapshot)
+                atexit.register(store.close)
+                migrate_embedded_images(store, get_image_store(data_dir))
+                _battery_store = store
+    return _battery_store
+
+
+def load_battery_store():
+    """启动时加载服务器根目录下data中的存储，避免由第一个请求承担加载时间"""
+    server_root = os.path.dirname(sys.executable) if getattr(sys, 'frozen', False) else os.path.dirname(os.path.abspath(__file__))
+    data_dir = os.path.join(server_root, 'data')
+    if not os.path.exists(data_dir):
+        os.makedirs(data_dir)
+    return get_battery_store(data_dir)
+
+
+def get_image_store(data_dir):
+    """获取进程级图片存储"""
+    global _image_store
+    if _image_store is None:
+        _image_store = ImageStore(data_dir)
+    return _image_store
+
+
+def get_thumbnail_cache(data_dir):
+    """获取进程级缩略图缓存"""
+    global _thumbnail_cache
+    if _thumbnail_cache is None:
+        with _battery_store_lock:
+            if _thumbnail_cache is None:
+                _thumbnail_cache = ThumbnailCache(data_dir, get_image_store(data_dir))
+    return _thumbnail_cache
+
+
+def get_event_broadcaster(store):
+    """获取进程级事件推送，首次调用时订阅存储的修改"""
+    global _event_broadcaster
+    if _event_broadcaster is None:
+        with _battery_store_lock:
+            if _event_broadcaster is None:
+                broadcaster = EventBroadcaster()
+                store.changes.subscribe(broadcaster.publish_change)
+                _event_broadcaster = broadcaster
+    return _event_broadcaster
+
 
 class BatteryServerHandler(SimpleHTTPRequestHandler):
     def __init__(self, *args, **kwargs):
@@ -25,23 +2224,28 @@ class BatteryServerHandler(SimpleHTTPRequestHandler):
         
         self.data_dir = os.path.join(self.server_root, 'data')
         self.ensure_data_files()
+        self.store = get_battery_store(self.data_dir)
+        self.images = get_image_store(self.data_dir)
         
         super().__init__(*args, directory=self.server_root, **kwargs)
     
     def ensure_data_files(self):
         """确保数据文件存在"""
+        with _data_files_lock:
+            self._ensure_data_files()
+
+    def _ensure_data_files(self):
         if not os.path.exists(self.data_dir):
             os.makedirs(self.data_dir)
         
-        # 创建默认的batteries.json
+        # 创建默认的batteries.json（只剩历史版本时由存储加载时恢复，不能覆盖）
         batteries_file = os.path.join(self.data_dir, 'batteries.json')
-        if not os.path.exists(batteries_file):
-            with open(batteries_file, 'w', encoding='utf-8') as f:
-                json.dump([], f, ensure_ascii=False, indent=2)
+        if not os.path.exists(batteries_file) and not os.path.exists(batteries_file + '.1'):
+            write_snapshot(batteries_file, [])
         
         # 创建默认的settings.json
         settings_file = os.path.join(self.data_dir, 'settings.json')
-        if not os.path.exists(settings_file):
+        if not os.path.exists(settings_file) and not os.path.exists(settings_file + '.1'):
             default_settings = {
                 "batteryModels": [
                     {"id": 1, "code": "K174", "name": "K174标准电池", "description": "标准容量电池，适用于XX型号车型", "createdAt": "2023-06-01"},
@@ -82,11 +2286,17 @@ class BatteryServerHandler(SimpleHTTPRequestHandler):
                 ]
             }
             
-            with open(settings_file, 'w', encoding='utf-8') as f:
-                json.dump(default_settings, f, ensure_ascii=False, indent=2)
+            write_snapshot(settings_file, default_settings)
     
+    # 当前响应要带上的ETag，只在200响应中发送
+    _etag = None
+    # 当前响应对应的数据修订号
+    _revision = None
+
     def do_GET(self):
         """处理GET请求"""
+        self._etag = None
+        self._revision = None
         parsed_path = urlparse(self.path)
         
         # API请求处理
@@ -123,20 +2333,120 @@ class BatteryServerHandler(SimpleHTTPRequestHandler):
         else:
             self.send_error(404)
     
+    def send_head(self):
+        """静态文件按修改时间和大小生成ETag，未变化时返回304；文本文件按需返回预压缩内容"""
+        path = self.translate_path(self.path)
+        if os.path.isfile(path):
+            stat = os.stat(path)
+            etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+            if self.not_modified(etag):
+                return None
+
+            encoding = None
+            if path in _static_cache:
+                compressible = stat.st_size >= MIN_COMPRESS_SIZE
+            else:
+                compressible = (path.lower().endswith(COMPRESSIBLE_EXTENSIONS)
+                                and MIN_COMPRESS_SIZE <= stat.st_size <= MAX_DYNAMIC_COMPRESS_SIZE)
+            if compressible:
+                encoding = choose_encoding(self.headers.get('Accept-Encoding'))
+            if encoding:
+                return self.send_compressed_file(path, encoding, etag)
+            self._etag = etag
+        return super().send_head()
+
+    def send_compressed_file(self, path, encoding, etag):
+        if path in _static_cache:
+            data, stat = _static_cache.get(path, encoding)
+        else:
+            with open(path, 'rb') as f:
+                stat = os.fstat(f.fileno())
+                data = compress(f.read(), encoding)
+        self.send_response(200)
+        self.send_header('Content-Type', self.guess_type(path))
+        self.send_header('Content-Encoding', encoding)
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('Last-Modified', self.date_time_string(stat.st_mtime))
+        self.send_header('Vary', 'Accept-Encoding')
+        self._etag = encoded_etag(etag, encoding)
+        self.end_headers()
+        return io.BytesIO(data)
+
+    def end_headers(self):
+        if self._etag:
+            self.send_header('ETag', self._etag)
+            self.send_header('Cache-Control', 'no-cache')
+            self._etag = None
+        super().end_headers()
+
+    def api_etag(self, path):
+        """API数据的ETag，由数据版本号生成"""
+        if path == '/api/settings':
+            return f'"{ETAG_EPOCH}-s{self.store.settings_version}"'
+        if path == '/api/statistics':
+            # 超时统计随日期变化
+            return f'"{ETAG_EPOCH}-{self.store.version}-{datetime.date.today():%Y%m%d}"'
+        if path == '/api/batteries':
+            etag = f'"{ETAG_EPOCH}-{self.store.version}"'
+            return format_etag(etag, choose_response_format(self.headers.get('Accept')))
+        if path.startswith('/api/batteries/'):
+            return f'"{ETAG_EPOCH}-{self.store.version}"'
+        return None
+
+    def not_modified(self, etag):
+        """If-None-Match与当前ETag一致时发送304并返回True"""
+        header = self.headers.get('If-None-Match')
+        if not header:
+            return False
+        tags = [tag.strip() for tag in header.split(',')]
+        tags = [tag[2:] if tag.startswith('W/') else tag for tag in tags]
+        # 客户端缓存的可能是压缩后的版本
+        variants = [etag] + [encoded_etag(etag, encoding) for encoding in supported_encodings()]
+        matched = next((tag for tag in tags if tag == '*' or tag in variants), None)
+        if matched is None:
+            return False
+
+        self.send_response(304)
+        self.send_header('ETag', etag if matched == '*' else matched)
+        self.end_headers()
+        return True
+
     def handle_api_get(self, parsed_path):
         """处理API GET请求"""
         try:
-            if parsed_path.path == '/api/batteries':
-                batteries_file = os.path.join(self.data_dir, 'batteries.json')
-                with open(batteries_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                self.send_json_response(data)
-            
+            # 先取ETag再读数据：读数据期间发生修改时ETag偏旧，只会导致下次多传一次
+            self._revision = self.store.changes.revision
+            etag = self.api_etag(parsed_path.path)
+            if etag:
+                if self.not_modified(etag):
+                    return
+                self._etag = etag
+
+            if parsed_path.path == '/api/events':
+                self.handle_events()
+
+            elif parsed_path.path == '/api/export':
+                self.handle_export(parse_qs(parsed_path.query))
+
+            elif parsed_path.path == '/api/batteries' or parsed_path.path.startswith('/api/batteries/'):
+                self.handle_batteries_get(parsed_path)
+
+            elif parsed_path.path == '/api/statistics':
+                self.send_json_response(get_statistics(self.store))
+
             elif parsed_path.path == '/api/settings':
-                settings_file = os.path.join(self.data_dir, 'settings.json')
-                with open(settings_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                self.send_json_response(data)
+                self.send_json_response(self.store.get_settings())
+
+            elif parsed_path.path.startswith('/api/images/'):
+                image_hash = parsed_path.path.split('/')[-1]
+                size = parse_qs(parsed_path.query).get('size', [''])[0]
+                if size:
+                    if not size.isdigit() or int(size) not in THUMBNAIL_SIZES:
+                        self.send_json_error(400, f'缩略图尺寸只能是: {THUMBNAIL_SIZES}')
+                        return
+                    self.send_thumbnail(image_hash, int(size))
+                else:
+                    self.send_image(image_hash)
             
             else:
                 self.send_error(404)
@@ -144,32 +2454,86 @@ class BatteryServerHandler(SimpleHTTPRequestHandler):
         except Exception as e:
             self.send_error(500, str(e))
     
+    def handle_batteries_get(self, parsed_path):
+        """/api/batteries下的GET请求，都支持fields=/exclude=字段投影"""
+        params = parse_qs(parsed_path.query)
+        try:
+            projection = parse_projection(params)
+        except ValueError as e:
+            self.send_json_error(400, str(e))
+            return
+
+        if parsed_path.path == '/api/batteries':
+            try:
+                criteria = parse_battery_query(params)
+            except ValueError as e:
+                self.send_json_error(400, str(e))
+                return
+
+            fmt = choose_response_format(self.headers.get('Accept'))
+            if criteria is None:
+                if projection == SUMMARY_PROJECTION:
+                    self.send_formatted(get_summary_records(self.store), fmt)
+                else:
+                    self.send_formatted(project_records(self.store.all(), projection), fmt)
+            else:
+                items, total = self.store.query(criteria)
+                items = project_records(items, projection)
+                if fmt == 'ndjson':
+                    # 每行一条记录，分页信息放在响应头中
+                    self.send_formatted(items, fmt, {
+                        'X-Total-Count': total,
+                        'X-Page': criteria['page'],
+                        'X-Page-Size': criteria['page_size'],
+                    })
+                else:
+                    self.send_formatted({
+                        'data': items,
+                        'total': total,
+                        'page': criteria['page'],
+                        'pageSize': criteria['page_size'],
+                    }, fmt)
+
+        elif parsed_path.path == '/api/batteries/search':
+            self.handle_prefix_search(params, projection)
+
+        elif parsed_path.path == '/api/batteries/fulltext':
+            self.handle_fulltext_search(params, projection)
+
+        elif parsed_path.path == '/api/batteries/changes':
+            self.handle_changes(params, projection)
+
+        else:
+            battery_id = parsed_path.path.split('/')[-1]
+            battery = self.store.get(battery_id)
+            if battery is None:
+                self.send_json_error(404, '未找到电池数据')
+            else:
+                self.send_json_response(project_record(battery, projection))
+
     def handle_api_post(self, parsed_path):
         """处理API POST请求"""
         try:
+            if parsed_path.path == '/api/images':
+                self.handle_image_upload()
+                return
+
             content_length = int(self.headers['Content-Length'])
             post_data = self.rfile.read(content_length)
-            data = json.loads(post_data.decode('utf-8'))
+            data = json_loads(post_data)
 
             if parsed_path.path == '/api/batteries':
-                batteries_file = os.path.join(self.data_dir, 'batteries.json')
-
-                # 读取现有数据
-                with open(batteries_file, 'r', encoding='utf-8') as f:
-                    batteries = json.load(f)
-
-                # 生成新ID
-                import time
-                new_id = str(int(time.time() * 1000))
-                new_battery = {**data, 'id': new_id}
-                batteries.append(new_battery)
-
-                # 保存数据
-                with open(batteries_file, 'w', encoding='utf-8') as f:
-                    json.dump(batteries, f, ensure_ascii=False, indent=2)
-
+                try:
+                    data = externalize_images(data, self.images)
+                except ValueError as e:
+                    self.send_json_error(400, str(e))
+                    return
+                new_battery = self.store.add(data)
                 self.send_json_response(new_battery)
 
+            elif parsed_path.path == '/api/batteries/batch':
+                self.handle_batch(data)
+
             else:
                 self.send_error(404)
 
@@ -181,34 +2545,23 @@ class BatteryServerHandler(SimpleHTTPRequestHandler):
         try:
             content_length = int(self.headers['Content-Length'])
             post_data = self.rfile.read(content_length)
-            data = json.loads(post_data.decode('utf-8'))
+            data = json_loads(post_data)
 
             if parsed_path.path == '/api/settings':
-                settings_file = os.path.join(self.data_dir, 'settings.json')
-
                 # 保存设置
-                with open(settings_file, 'w', encoding='utf-8') as f:
-                    json.dump(data, f, ensure_ascii=False, indent=2)
+                self.store.save_settings(data)
 
                 self.send_json_response(data)
 
             elif parsed_path.path.startswith('/api/batteries/'):
                 # 更新电池数据
                 battery_id = parsed_path.path.split('/')[-1]
-                batteries_file = os.path.join(self.data_dir, 'batteries.json')
-
-                with open(batteries_file, 'r', encoding='utf-8') as f:
-                    batteries = json.load(f)
-
-                # 查找并更新电池
-                for i, battery in enumerate(batteries):
-                    if battery.get('id') == battery_id:
-                        batteries[i] = {**battery, **data}
-                        break
-
-                # 保存数据
-                with open(batteries_file, 'w', encoding='utf-8') as f:
-                    json.dump(batteries, f, ensure_ascii=False, indent=2)
+                try:
+                    data = externalize_images(data, self.images)
+                except ValueError as e:
+                    self.send_json_error(400, str(e))
+                    return
+                self.store.update(battery_id, data)
 
                 self.send_json_response({"success": True})
 
@@ -224,17 +2577,7 @@ class BatteryServerHandler(SimpleHTTPRequestHandler):
             if parsed_path.path.startswith('/api/batteries/'):
                 # 删除电池数据
                 battery_id = parsed_path.path.split('/')[-1]
-                batteries_file = os.path.join(self.data_dir, 'batteries.json')
-
-                with open(batteries_file, 'r', encoding='utf-8') as f:
-                    batteries = json.load(f)
-
-                # 过滤掉要删除的电池
-                batteries = [b for b in batteries if b.get('id') != battery_id]
-
-                # 保存数据
-                with open(batteries_file, 'w', encoding='utf-8') as f:
-                    json.dump(batteries, f, ensure_ascii=False, indent=2)
+                self.store.delete(battery_id)
 
                 self.send_json_response({"success": True})
             else:
@@ -242,46 +2585,672 @@ class BatteryServerHandler(SimpleHTTPRequestHandler):
         except Exception as e:
             self.send_error(500, str(e))
     
-    def send_json_response(self, data):
-        """发送JSON响应"""
-        response = json.dumps(data, ensure_ascii=False, indent=2)
+    def handle_events(self):
+        """
+        SSE事件流：每次新增/修改/删除推送 {id, revision, op}
+        连接建立时先推送hello事件携带当前修订号，客户端可据此调用/api/batteries/changes补齐
+        """
+        detach_request = getattr(self.server, 'detach_request', None)
+        if detach_request is None:
+            self.send_json_error(503, '当前服务器模式不支持事件推送')
+            return
+
+        broadcaster = get_event_broadcaster(self.store)
         self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream; charset=utf-8')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('X-Accel-Buffering', 'no')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self.wfile.flush()
+
+        revision = self.store.changes.revision
+        initial = b'retry: 3000\n\n' + format_event('hello', {'revision': revision}, revision)
+        # 连接交给推送线程，工作线程返回后服务器不再关闭它
+        self.close_connection = True
+        detach_request(self.request)
+        broadcaster.add_client(self.connection, initial)
+
+    def handle_batch(self, data):
+        """
+        批量写入：请求体为操作数组（或{"operations": [...]}），整批原子生效
+        返回与操作一一对应的结果，create/update为写入后的记录，delete为{"id": ..., "deleted": true}
+        """
+        operations = data.get('operations') if isinstance(data, dict) else data
+        try:
+            operations = parse_batch_operations(operations)
+        except ValueError as e:
+            self.send_json_error(400, str(e))
+            return
+
+        try:
+            operations = [
+                (op, battery_id, data if op == 'delete' else externalize_images(data, self.images))
+                for op, battery_id, data in operations
+            ]
+        except ValueError as e:
+            self.send_json_error(400, str(e))
+            return
+        try:
+            results = self.store.batch(operations)
+        except KeyError as e:
+            self.send_json_error(404, e.args[0])
+            return
+
+        self.send_json_response({
+            'count': len(results),
+            'results': [
+                {'id': battery_id, 'deleted': True} if op == 'delete' else result
+                for (op, battery_id, _), result in zip(operations, results)
+            ],
+        })
+
+    def handle_export(self, params):
+        """
+        导出记录：format=csv|xlsx，其余参数与/api/batteries的筛选条件相同
+        没有format参数时按Accept协商ndjson/msgpack/json，都不接受时导出CSV
+        """
+        fmt = params.get('format', [''])[0].lower()
+        if fmt and fmt not in EXPORT_FORMATS:
+            self.send_json_error(400, f'format只能是: {", ".join(EXPORT_FORMATS)}')
+            return
+        if not fmt:
+            accept = self.headers.get('Accept') or ''
+            fmt = choose_response_format(accept)
+            if fmt == 'json' and 'application/json' not in accept:
+                fmt = 'csv'
+        try:
+            criteria = parse_battery_query(params, force=True)
+        except ValueError as e:
+            self.send_json_error(400, str(e))
+            return
+
+        records = self.store.select(criteria)
+        filename = f'电池维修记录_{datetime.date.today().isoformat()}.{fmt}'
+        disposition = {
+            'Content-Disposition': "attachment; filename=\"battery_records.%s\"; filename*=UTF-8''%s"
+                                   % (fmt, quote(filename)),
+        }
+
+        if fmt == 'csv':
+            self.send_stream(iter_csv_export(records), 'text/csv; charset=utf-8', disposition)
+        elif fmt == 'xlsx':
+            self.send_xlsx_export(records, disposition)
+        elif fmt == 'json':
+            self.send_json_response(list(records))
+        else:
+            self.send_formatted(records if fmt == 'ndjson' else list(records), fmt)
+
+    def send_xlsx_export(self, records, headers):
+        """Excel是zip格式，只能写完再发送；先写入临时文件，内存占用与记录数无关"""
+        try:
+            import openpyxl  # type: ignore  # noqa: F401
+        except ImportError:
+            self.send_json_error(501, '导出Excel需要安装openpyxl库，请运行: pip install openpyxl')
+            return
+
+        with tempfile.TemporaryFile() as f:
+            write_xlsx_export(records, f)
+            size = f.tell()
+            f.seek(0)
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header('Content-Length', str(size))
+            self.send_api_headers()
+            self.end_headers()
+            shutil.copyfileobj(f, self.wfile)
+
+    def handle_changes(self, params, projection=None):
+        """
+        增量同步：返回修订号since之后新增/修改的记录和删除的记录ID
+        reset为true时游标已过期，客户端需要重新获取全部记录
+        """
+        try:
+            since = int(params.get('since', [''])[0])
+        except ValueError:
+            self.send_json_error(400, 'since必须是整数修订号')
+            return
+
+        reset, revision, upsert_ids, deleted = self.store.changes.since(since)
+        upserts = []
+        for battery_id in upsert_ids:
+            record = self.store.get(battery_id)
+            if record is None:
+                # 读取期间被删除
+                deleted.append(battery_id)
+            else:
+                upserts.append(project_record(record, projection))
+        self.send_json_response({
+            'revision': revision,
+            'reset': reset,
+            'upserts': upserts,
+            'deleted': deleted,
+        })
+
+    def handle_prefix_search(self, params, projection=None):
+        """按BT码或BMS编号前缀搜索，exactMatch表示是否存在完全相同的编号"""
+        prefix = params.get('prefix', [''])[0].strip()
+        field = params.get('field', [''])[0]
+        if not prefix:
+            self.send_json_error(400, '缺少prefix参数')
+            return
+        if field and field not in PREFIX_FIELDS:
+            self.send_json_error(400, f'field只能是: {", ".join(PREFIX_FIELDS)}')
+            return
+        try:
+            limit = min(int(params.get('limit', [DEFAULT_SEARCH_LIMIT])[0]), MAX_SEARCH_LIMIT)
+        except ValueError:
+            self.send_json_error(400, 'limit必须是整数')
+            return
+
+        fields = (field,) if field else None
+        ids = self.store.code_index.search(prefix, limit, fields)
+        records = [record for record in (self.store.get(battery_id) for battery_id in ids) if record]
+        self.send_json_response({
+            'prefix': prefix,
+            'exactMatch': self.store.code_index.contains(prefix, fields),
+            'data': project_records(records, projection),
+        })
+
+    def handle_fulltext_search(self, params, projection=None):
+        """在原因分析、改善措施、维修措施中全文检索，按相关度返回记录"""
+        query = params.get('q', [''])[0].strip()
+        if not query:
+            self.send_json_error(400, '缺少q参数')
+            return
+        try:
+            limit = max(1, min(int(params.get('limit', [DEFAULT_FULLTEXT_LIMIT])[0]), MAX_PAGE_SIZE))
+        except ValueError:
+            self.send_json_error(400, 'limit必须是整数')
+            return
+
+        ids, total = self.store.text_index.search(query, limit)
+        records = [record for record in (self.store.get(battery_id) for battery_id in ids) if record]
+        self.send_json_response({'q': query, 'total': total, 'data': project_records(records, projection)})
+
+    def handle_image_upload(self):
+        """上传图片：请求体为图片原始字节，返回图片hash和访问地址"""
+        content_length = int(self.headers.get('Content-Length') or 0)
+        if content_length <= 0:
+            self.send_json_error(400, '图片内容为空')
+            return
+        if content_length > MAX_IMAGE_SIZE:
+            self.send_json_error(413, '图片过大')
+            return
+
+        data = self.rfile.read(content_length)
+        image_hash = self.images.put(data)
+        self.send_json_response({
+            'hash': image_hash,
+            'size': len(data),
+            'type': ImageStore.content_type(data[:16]),
+            'url': image_url(image_hash),
+        })
+
+    def send_thumbnail(self, image_hash, size):
+        """发送指定尺寸的缩略图，未安装Pillow时返回原图"""
+        if not self.images.exists(image_hash):
+            self.send_json_error(404, '图片不存在')
+            return
+
+        thumbnails = get_thumbnail_cache(self.data_dir)
+        thumbnail = None
+        if thumbnails.available:
+            try:
+                thumbnail = thumbnails.open(image_hash, size)
+            except Exception as e:
+                # 无法解码的图片直接返回原图
+                print(f"生成缩略图失败: {e}")
+        self.send_image(image_hash, thumbnail)
+
+    def send_image(self, image_hash, f=None):
+        """发送图片（f为已打开的缩略图文件），内容按hash寻址永不变化，允许客户端长期缓存"""
+        if f is None:
+            if not self.images.exists(image_hash):
+                self.send_json_error(404, '图片不存在')
+                return
+            f = open(self.images.path(image_hash), 'rb')
+
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            self.send_response(200)
+            self.send_header('Content-Type', ImageStore.content_type(f.read(16)))
+            self.send_header('Content-Length', str(size))
+            self.send_header('Cache-Control', 'public, max-age=31536000, immutable')
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
+            f.seek(0)
+            shutil.copyfileobj(f, self.wfile)
+
+    def send_json_error(self, status, message):
+        """发送JSON格式的错误响应"""
+        self.send_json_response({'error': message}, status)
+
+    def send_json_response(self, data, status=200):
+        """发送JSON响应，记录较多的列表改为分块流式发送"""
+        if status != 200:
+            self._etag = None
+        elif isinstance(data, list) and len(data) >= STREAM_MIN_RECORDS:
+            self.send_json_stream(data)
+            return
+
+        response = json_dumps(data)
+
+        encoding = None
+        if len(response) >= MIN_COMPRESS_SIZE:
+            encoding = choose_encoding(self.headers.get('Accept-Encoding'))
+        if encoding:
+            response = compress(response, encoding)
+            if self._etag:
+                self._etag = encoded_etag(self._etag, encoding)
+
+        self.send_response(status)
         self.send_header('Content-Type', 'application/json; charset=utf-8')
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        self.send_header('Content-Length', str(len(response)))
+        self.send_api_headers()
+        self.end_headers()
+        self.wfile.write(response)
+
+    def send_json_stream(self, records):
+        """逐条编码JSON数组并分块发送，不在内存中生成完整响应"""
+        self.send_stream(iter_json_array(records), FORMAT_CONTENT_TYPES['json'])
+
+    def send_formatted(self, data, fmt, headers=None):
+        """按协商的格式发送响应；ndjson只用于记录列表"""
+        if fmt == 'ndjson':
+            self.send_stream(iter_ndjson(data), FORMAT_CONTENT_TYPES['ndjson'], headers)
+        elif fmt == 'msgpack':
+            pieces = iter_msgpack_array(data) if isinstance(data, list) else [msgpack.packb(data, use_bin_type=True)]
+            self.send_stream(pieces, FORMAT_CONTENT_TYPES['msgpack'], headers)
+        else:
+            self.send_json_response(data)
+
+    def send_stream(self, pieces, content_type, headers=None):
+        """
+        分块发送响应体，pieces逐段产出str或bytes
+        HTTP/1.1客户端使用chunked传输编码，HTTP/1.0客户端以关闭连接结束响应
+        """
+        encoding = choose_encoding(self.headers.get('Accept-Encoding'))
+        if encoding and self._etag:
+            self._etag = encoded_etag(self._etag, encoding)
+        chunked = self.request_version == 'HTTP/1.1'
+        if chunked:
+            self.protocol_version = 'HTTP/1.1'
+
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        for name, value in (headers or {}).items():
+            self.send_header(name, str(value))
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        if chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        self.send_header('Connection', 'close')
+        self.send_api_headers()
+        self.end_headers()
+
+        compressor = StreamCompressor(encoding) if encoding else None
+
+        def write(data, final=False):
+            if compressor:
+                data = compressor.compress(data)
+                if final:
+                    data += compressor.finish()
+            if data:
+                self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data) if chunked else data)
+
+        pending = []
+        size = 0
+        for piece in pieces:
+            if isinstance(piece, str):
+                piece = piece.encode('utf-8')
+            pending.append(piece)
+            size += len(piece)
+            if size >= STREAM_CHUNK_SIZE:
+                write(b''.join(pending))
+                pending = []
+                size = 0
+        write(b''.join(pending), final=True)
+        if chunked:
+            self.wfile.write(b'0\r\n\r\n')
+
+    def send_api_headers(self):
+        """API响应共用的头部"""
+        self.send_header('Vary', 'Accept, Accept-Encoding')
+        self.send_header('X-Data-Revision', str(self._revision or self.store.changes.revision))
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'GET, POST, PUT, DELETE, OPTIONS')
         self.send_header('Access-Control-Allow-Headers', 'Content-Type')
-        self.end_headers()
-        self.wfile.write(response.encode('utf-8'))
+        self.send_header('Access-Control-Expose-Headers', 'ETag, X-Data-Revision, X-Total-Count, X-Page, X-Page-Size')
 
-def start_server(host='0.0.0.0', port=3000):
+# listen队列的最小长度（TCPServer默认只有5）
+MIN_LISTEN_BACKLOG = 128
+
+
+class BatteryHTTPServer(socketserver.TCPServer):
+    """
+    单线程HTTP服务器
+    处理函数可以接管连接（如SSE长连接），接管后服务器不再关闭它
+    """
+
+    allow_reuse_address = True
+    request_queue_size = MIN_LISTEN_BACKLOG
+
+    def __init__(self, *args, **kwargs):
+        self._detached = set()
+        self._detached_lock = threading.Lock()
+        super().__init__(*args, **kwargs)
+
+    def detach_request(self, request):
+        """由处理函数调用，表示连接已交给别处管理"""
+        with self._detached_lock:
+            self._detached.add(request)
+
+    def shutdown_request(self, request):
+        with self._detached_lock:
+            if request in self._detached:
+                self._detached.discard(request)
+                return
+        super().shutdown_request(request)
+
+
+class ThreadPoolHTTPServer(BatteryHTTPServer):
+    """
+    线程池HTTP服务器
+    固定数量的工作线程从有界队列中取连接处理，队列满时接收线程阻塞等待，
+    避免单个慢客户端（大文件下载、Excel导入）阻塞其他请求
+    """
+
+    def __init__(self, server_address, RequestHandlerClass, workers=8, queue_size=None):
+        self.workers = max(1, workers)
+        self.queue_size = queue_size if queue_size else self.workers * 4
+        # 内核的listen队列也要足够长，否则突发连接在进入工作队列前就被重置
+        self.request_queue_size = max(self.queue_size, MIN_LISTEN_BACKLOG)
+        self._requests = queue.Queue(maxsize=self.queue_size)
+        self._threads = []
+        super().__init__(server_address, RequestHandlerClass)
+
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker_loop, name=f'BatteryServerWorker-{i}', daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def process_request(self, request, client_address):
+        """把连接放入队列，由工作线程处理"""
+        self._requests.put((request, client_address))
+
+    def _worker_loop(self):
+        while True:
+            item = self._requests.get()
+            if item is None:
+                break
+            request, client_address = item
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        for _ in self._threads:
+            self._requests.put(None)
+
+
+def create_server(host, port, workers=8, queue_size=None):
+    """创建服务器实例，workers为0时使用单线程模式"""
+    if workers and workers > 0:
+        return ThreadPoolHTTPServer((host, port), BatteryServerHandler, workers=workers, queue_size=queue_size)
+    return BatteryHTTPServer((host, port), BatteryServerHandler)
+
+
+# 服务器引擎: threaded（默认，http.server线程池）或 asyncio
+SERVER_ENGINES = ('threaded', 'asyncio')
+# asyncio引擎允许的最大请求头
+MAX_REQUEST_HEADER_SIZE = 64 * 1024
+# asyncio引擎中单个SSE客户端最多积压的事件数
+MAX_EVENT_BACKLOG = 1000
+
+
+class AsyncConnection:
+    """
+    asyncio引擎交给处理线程的连接对象
+    请求已由事件循环完整读入，响应写出时回到事件循环并等待drain，慢客户端会让处理线程等待而不是无限缓冲
+    """
+
+    closed = False
+
+    def __init__(self, loop, writer, data):
+        self.loop = loop
+        self.writer = writer
+        self.data = data
+
+    def write(self, data):
+        if data:
+            asyncio.run_coroutine_threadsafe(self._write(bytes(data)), self.loop).result()
+        return len(data)
+
+    async def _write(self, data):
+        self.writer.write(data)
+        await self.writer.drain()
+
+    def flush(self):
+        pass
+
+
+class AsyncRequestHandler(BatteryServerHandler):
+    """在线程池中处理asyncio引擎读到的请求，复用BatteryServerHandler的全部路由"""
+
+    def setup(self):
+        self.connection = self.request
+        self.rfile = io.BytesIO(self.request.data)
+        self.wfile = self.request
+
+    def finish(self):
+        pass
+
+
+class AsyncBatteryServer:
+    """
+    asyncio服务器引擎
+    事件循环负责接收连接、读取请求和推送SSE事件，请求处理（文件读写、存储访问）放到线程池执行，
+    空闲连接和SSE长连接只占用一个协程
+    """
+
+    def __init__(self, host, port, workers=8):
+        self.host = host
+        self.port = port
+        self.workers = max(1, workers or 1)
+        self._event_queues = {}
+        self._store = None
+        self._loop = None
+        self._executor = None
+        self._server = None
+
+    async def serve_forever(self, ready=None):
+        self._loop = asyncio.get_running_loop()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='BatteryServerWorker')
+        self._loop.set_default_executor(self._executor)
+
+        # 提前加载存储，订阅修改通知用于SSE推送
+        self._store = await self._loop.run_in_executor(None, load_battery_store)
+        self._store.changes.subscribe(self._on_change)
+
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port,
+                                                  reuse_address=True, limit=MAX_REQUEST_HEADER_SIZE)
+        if ready:
+            ready()
+        try:
+            async with self._server:
+                await self._server.serve_forever()
+        finally:
+            self._executor.shutdown(wait=False)
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            try:
+                head = await reader.readuntil(b'\r\n\r\n')
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                return
+
+            request_line = head.split(b'\r\n', 1)[0].split()
+            if len(request_line) >= 2 and request_line[0] == b'GET' and urlparse(request_line[1].decode('latin-1')).path == '/api/events':
+                await self._serve_events(writer)
+                return
+
+            length = 0
+            for line in head.split(b'\r\n')[1:]:
+                name, _, value = line.partition(b':')
+                if name.strip().lower() == b'content-length':
+                    try:
+                        length = max(0, int(value.strip()))
+                    except ValueError:
+                        length = 0
+            try:
+                body = await reader.readexactly(length) if length else b''
+            except (asyncio.IncompleteReadError, ConnectionError):
+                return
+
+            connection = AsyncConnection(self._loop, writer, head + body)
+            peer = writer.get_extra_info('peername') or ('', 0)
+            await self._loop.run_in_executor(None, self._process, connection, peer[:2])
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+
+    def _process(self, connection, client_address):
+        try:
+            AsyncRequestHandler(connection, client_address, self)
+        except (ConnectionError, OSError):
+            # 客户端中途断开
+            pass
+        except Exception:
+            import traceback
+            traceback.print_exc()
+
+    def _on_change(self, battery_id, revision, operation):
+        """在修改线程中调用，转交事件循环广播"""
+        message = format_event('change', {'id': battery_id, 'revision': revision, 'op': operation}, revision)
+        self._loop.call_soon_threadsafe(self._publish, message)
+
+    def _publish(self, message):
+        for events, writer in list(self._event_queues.items()):
+            if events.full():
+                # 客户端太慢，断开连接
+                del self._event_queues[events]
+                writer.transport.abort()
+            else:
+                events.put_nowait(message)
+
+    async def _serve_events(self, writer):
+        """SSE事件流，格式与线程池引擎的/api/events一致"""
+        events = asyncio.Queue(maxsize=MAX_EVENT_BACKLOG)
+        self._event_queues[events] = writer
+        try:
+            revision = self._store.changes.revision
+            writer.write(b'HTTP/1.0 200 OK\r\n'
+                         b'Content-Type: text/event-stream; charset=utf-8\r\n'
+                         b'Cache-Control: no-cache\r\n'
+                         b'X-Accel-Buffering: no\r\n'
+                         b'Access-Control-Allow-Origin: *\r\n\r\n'
+                         b'retry: 3000\n\n' + format_event('hello', {'revision': revision}, revision))
+            await writer.drain()
+            while True:
+                try:
+                    message = await asyncio.wait_for(events.get(), EVENT_KEEPALIVE_INTERVAL)
+                except asyncio.TimeoutError:
+                    message = b': keepalive\n\n'
+                writer.write(message)
+                await writer.drain()
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            self._event_queues.pop(events, None)
+
+
+def start_server(host='0.0.0.0', port=3000, workers=8, queue_size=None, storage=None,
+                 engine='threaded', open_browser=True, recover=False):
     """启动服务器"""
-    import sys
-    
+    global _storage_engine, _recover_snapshot
+    if recover:
+        _recover_snapshot = True
+    if storage:
+        if storage not in STORAGE_ENGINES:
+            raise ValueError(f"不支持的存储引擎: {storage}")
+        _storage_engine = storage
+    if engine not in SERVER_ENGINES:
+        raise ValueError(f"不支持的服务器引擎: {engine}")
+
     print(f"启动电池售后管理系统服务器...")
     print(f"服务器地址: http://{host}:{port}")
+    if workers and workers > 0:
+        print(f"工作线程数: {workers}")
+    else:
+        print("单线程模式")
+    print(f"存储引擎: {_storage_engine}")
+    print(f"服务器引擎: {engine}")
     
-    # 启动服务器
-    with socketserver.TCPServer((host, port), BatteryServerHandler) as httpd:
+    # 开始监听前加载存储（快照加载、日志重放、索引建立）
+    try:
+        load_battery_store()
+    except SnapshotCorruptError as e:
+        print(f"无法加载电池数据: {e}")
+        sys.exit(1)
+
+    # 后台预压缩静态文件，未完成前的请求按需压缩
+    static_root = os.path.dirname(sys.executable) if getattr(sys, 'frozen', False) else os.path.dirname(os.path.abspath(__file__))
+    threading.Thread(target=_static_cache.warm, args=(static_root,), name='StaticCompression', daemon=True).start()
+    
+    # 自动打开浏览器
+    def open_browser_later():
+        time.sleep(2)
+        webbrowser.open(f"http://localhost:{port}")
+
+    def on_ready():
         print(f"服务器运行在 http://{host}:{port}")
-        
-        # 自动打开浏览器
-        def open_browser():
-            import time
-            time.sleep(2)
-            webbrowser.open(f"http://localhost:{port}")
-        
-        threading.Thread(target=open_browser, daemon=True).start()
-        
-        try:
-            httpd.serve_forever()
-        except KeyboardInterrupt:
-            print("\n服务器已停止")
+        if open_browser:
+            threading.Thread(target=open_browser_later, daemon=True).start()
+
+    # 启动服务器
+    try:
+        if engine == 'asyncio':
+            asyncio.run(AsyncBatteryServer(host, port, workers).serve_forever(on_ready))
+        else:
+            with create_server(host, port, workers, queue_size) as httpd:
+                on_ready()
+                httpd.serve_forever()
+    except KeyboardInterrupt:
+        if _battery_store is not None:
+            _battery_store.close()
+        print("\n服务器已停止")
 
 if __name__ == "__main__":
-    import sys
+    import argparse
     
     # 从环境变量或命令行参数获取配置
-    host = os.environ.get('HOST', '0.0.0.0')
-    port = int(os.environ.get('PORT', '3000'))
+    parser = argparse.ArgumentParser(description='电池售后管理系统服务器')
+    parser.add_argument('--host', default=os.environ.get('HOST', '0.0.0.0'), help='监听地址')
+    parser.add_argument('--port', type=int, default=int(os.environ.get('PORT', '3000')), help='监听端口')
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('WORKERS', '8')),
+                        help='工作线程数，0表示单线程模式')
+    parser.add_argument('--queue-size', type=int, default=int(os.environ.get('QUEUE_SIZE', '0')),
+                        help='等待处理的连接队列长度，默认为工作线程数的4倍')
+    parser.add_argument('--storage', choices=STORAGE_ENGINES, default=_storage_engine,
+                        help='存储引擎，sqlite首次启动时自动从JSON文件迁移数据')
+    parser.add_argument('--engine', choices=SERVER_ENGINES, default=os.environ.get('ENGINE', 'threaded'),
+                        help='服务器引擎，asyncio适合大量空闲连接和SSE推送')
+    parser.add_argument('--no-browser', action='store_true', help='启动后不自动打开浏览器')
+    parser.add_argument('--recover', action='store_true', default=_recover_snapshot,
+                        help='batteries.json损坏时从历史版本恢复（会丢失该版本之后的修改）')
+    args = parser.parse_args()
     
-    start_server(host, port)
+    start_server(args.host, args.port, args.workers, args.queue_size or None, args.storage,
+                 args.engine, not args.no_browser, args.recover)
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""
+PrefixIndex测试：同一BT码对应多条记录，记录ID缺失或类型不一致时不能出错
+运行: python -m pytest tests 或 python -m unittest discover tests
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from python_server import PrefixIndex  # noqa: E402
+
+
+class PrefixIndexTest(unittest.TestCase):
+    def test_duplicate_code_with_missing_id(self):
+        index = PrefixIndex([{'id': '1', 'batteryBtCode': 'BT1'}, {'batteryBtCode': 'BT1'}])
+        self.assertEqual(index.search('bt1'), ['1', None])
+        self.assertTrue(index.contains('BT1'))
+
+    def test_duplicate_code_with_mixed_id_types(self):
+        index = PrefixIndex([{'id': 5, 'batteryBtCode': 'BT0001'}, {'id': '6', 'batteryBtCode': 'BT0001'}])
+        self.assertEqual(index.search('BT000'), [5, '6'])
+
+        index.replace(None, {'batteryBtCode': 'BT0001'})
+        index.replace(None, {'id': 7.0, 'batteryBtCode': 'bt0001'})
+        self.assertEqual(index.search('BT0001'), [5, '6', None, 7.0])
+
+    def test_replace_and_delete_duplicates(self):
+        first = {'id': '1', 'batteryBtCode': 'BT1', 'bmsNumber': 'BMS1'}
+        second = {'id': 2, 'batteryBtCode': 'BT1'}
+        index = PrefixIndex([first, second])
+
+        index.replace(first, {**first, 'batteryBtCode': 'BT2'})
+        self.assertEqual(index.search('BT1'), [2])
+        self.assertEqual(index.search('BT2'), ['1'])
+
+        index.replace(second, None)
+        self.assertEqual(index.search('BT1'), [])
+        self.assertFalse(index.contains('BT1'))
+        self.assertEqual(index.search('BMS'), ['1'])
+
+    def test_limit(self):
+        index = PrefixIndex([{'id': str(i), 'batteryBtCode': 'BT1'} for i in range(5)])
+        self.assertEqual(index.search('BT', limit=3), ['0', '1', '2'])
+
+
+if __name__ == '__main__':
+    unittest.main()